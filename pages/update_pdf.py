@@ -1,12 +1,12 @@
 import streamlit as st
 import pandas as pd
-import pdfplumber
-import re
 import os
 from datetime import datetime
-import base64
-from io import BytesIO
-import tempfile
+from contextlib import nullcontext
+from utils.br_format import parse_brl_number
+from utils.nfse_pdf import NFSE_CACHE_MAX_BYTES, NFSE_CACHE_NAMESPACE, NFSE_CACHE_VERSION, extract_nfse_batch
+from utils.content_cache import ContentCache
+from utils.export import dataset_version, deferred_download_button, to_excel_bytes, uploaded_files_version
 
 # Set page config
 st.set_page_config(
@@ -51,248 +51,6 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-def convert_brazilian_number(value):
-    """Convert Brazilian number format (1.234,56) to float."""
-    if pd.isna(value) or value is None:
-        return 0.0
-    try:
-        # Remove all dots and replace comma with dot
-        clean_value = value.replace('.', '').replace(',', '.')
-        return float(clean_value)
-    except (ValueError, AttributeError):
-        return 0.0
-
-def extrair_dados_nf(pdf_file):
-    """Extrai dados importantes da Nota Fiscal do PDF."""
-    dados_nf = {
-        "Numero NFS-e": None,
-        "Data Emissão": None,
-        "Competencia": None,
-        "Codigo de Verificacao": None,
-        "Numero RPS": None,
-        "NF-e Substituida": None,
-        "Razao Social Prestador": None,
-        "CNPJ Prestador": None,
-        "Telefone Prestador": None,
-        "Email Prestador": None,
-        "Razao Social Tomador": None,
-        "CNPJ Tomador": None,
-        "Endereco Tomador": None,
-        "Telefone Tomador": None,
-        "Email Tomador": None,
-        "Discriminacao do Servico": None,
-        "Codigo Servico": None,
-        "Detalhamento Especifico": None,
-        "Codigo da Obra": None,
-        "Codigo ART": None,
-        "Tributos Federais": None,
-        "Valor do Servico": None,
-        "Desconto Incondicionado": None,
-        "Desconto Condicionado": None,
-        "Retencao Federal": None,
-        "ISSQN Retido": None,
-        "Valor Liquido": None,
-        "Regime Especial Tributacao": None,
-        "Simples Nacional": None,
-        "Incentivador Cultural": None,
-        "Avisos": None,
-        "Nome do Arquivo": pdf_file.name,
-    }
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-        tmp_file.write(pdf_file.getvalue())
-        tmp_file_path = tmp_file.name
-
-    try:
-        with pdfplumber.open(tmp_file_path) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                
-                if not text:
-                    st.warning(f"Falha ao extrair texto do PDF: {pdf_file.name}")
-                    continue
-
-                # Numero NFS-e
-                match = re.search(r"NFS-e\s*:?\s*([\d]+)", text)
-                if match:
-                    dados_nf["Numero NFS-e"] = match.group(1).strip()
-                
-                # Data Emissão
-                match = re.search(r"Data e Hora da Emissão\s*:?\s*([\d]{1,2}/[\d]{1,2}/[\d]{4}\s+\d{1,2}:\d{2})", text)
-                if match:
-                    dados_nf["Data Emissão"] = match.group(1).strip()
-
-                # Captura a Competência
-                match = re.search(r"Competência\s*:?\s*(.+)", text)
-                if match:
-                    dados_nf["Competencia"] = match.group(1).strip()
-                    
-                # Código de Verificação
-                match = re.search(r"Código de Verificação\s*:?\s*(.+)", text)
-                if match:  
-                    dados_nf["Codigo de Verificacao"] = match.group(1).strip()
-
-                # Captura o Número do RPS
-                match = re.search(r"Número do RPS\s*:?\s*([\d]+)", text)
-                if match:
-                    dados_nf["Numero RPS"] = match.group(1).strip()
-
-                # Captura a NFS-e Substituída
-                match = re.search(r"No. da NFS-e substituída\s*:?\s*([\d]+)", text)
-                if match:
-                    dados_nf["NF-e Substituida"] = match.group(1).strip()
-                
-                # Captura a Razão Social
-                if match:
-                    dados_nf["Razao Social Tomador"] = match.group(1).strip()
-                match = re.search(r"Razão Social/Nome\s*:?\s*(.+)", text)
-                
-                # Captura o CNPJ do Prestador  
-                if match:
-                    dados_nf["Razao Social Prestador"] = match.group(1).strip()
-                match = re.search(r"CNPJ/CPF\s*:?\s*([\d\.\-/]+)", text)
-                if match:
-                    dados_nf["CNPJ Prestador"] = match.group(1).strip()
-
-                # Telefone do Prestador
-                match = re.search(r"Telefone\s*:?\s*([\d\(\)\s\-]+)", text)
-                if match:
-                    dados_nf["Telefone Prestador"] = match.group(1).strip()
-                    
-                # E-mail do Prestador
-                match = re.search(r"e-mail\s*:?\s*([\w\.\-]+@[\w\.\-]+)", text)
-                if match:
-                    dados_nf["Email Prestador"] = match.group(1).strip()
-
-                # Razão Social do Tomador
-                match = re.search(r"Tomador de Serviço\s*Razão Social/Nome\s*:?\s*(.+)", text)
-                if match:
-                    dados_nf["Razao Social Tomador"] = match.group(1).strip()
-                    
-                # CNPJ do Tomador   
-                match = re.search(r"CNPJ/CPF\s*:?\s*([\d\.\-/]+)", text)
-                if match:
-                    dados_nf["CNPJ Tomador"] = match.group(1).strip()
-
-                # Endereço do Tomador
-                match = re.search(r"Endereço e CEP\s*:?\s*(.+)", text)
-                if match:
-                    dados_nf["Endereco Tomador"] = match.group(1).strip()
-
-                # Telefone do Tomador
-                match = re.search(r"Telefone\s*:?\s*([\d\(\)\s\-]+)", text)
-                if match:
-                    dados_nf["Telefone Tomador"] = match.group(1).strip()
-                    
-                # E-mail do Tomador    
-                match = re.search(r"e-mail\s*:?\s*([\w\.\-]+@[\w\.\-]+)", text)
-                if match:
-                    dados_nf["Email Tomador"] = match.group(1).strip()
-
-                # Captura a Discriminação do Serviço ou Discriminação dos Serviços
-                match = re.search(r"Discriminação (do|dos) Serviço(s)?\s*(.+?)(?=Código do Serviço|Detalhamento Específico|Tributos Federais|Valor do Serviço)", text, re.DOTALL)
-                if match:
-                    dados_nf["Discriminacao do Servico"] = match.group(3).strip()
-
-                # Captura o Código do Serviço
-                match = re.search(r"Código do Serviço\s*/\s*Atividade\s*(.+)", text)
-                if match:
-                    dados_nf["Codigo Servico"] = match.group(1).strip()
-
-                # Detalhamento Específico da Construção Civil
-                match = re.search(r"Detalhamento Específico da Construção Civil\s*(.+)", text)
-                if match:
-                    dados_nf["Detalhamento Especifico"] = match.group(1).strip()
-
-                # Código da Obra
-                match = re.search(r"Código da Obra\s*(.+)", text)
-                if match:
-                    dados_nf["Codigo da Obra"] = match.group(1).strip()
-
-                # Código ART
-                match = re.search(r"Código ART\s*(.+)", text)
-                if match:
-                    dados_nf["Codigo ART"] = match.group(1).strip()
-
-                # Tributos Federais
-                match = re.search(r"Tributos Federais\s*(.+)", text)
-                if match:
-                    dados_nf["Tributos Federais"] = match.group(1).strip()
-
-                # Valor do Serviço
-                match = re.search(r"Valor (do|dos) Serviço(s)?\s*R\$\s*([\d,\.]+)", text)
-                if match:
-                    dados_nf["Valor do Servico"] = match.group(3).strip()  # Grupo correto
-                else:
-                    dados_nf["Valor do Servico"] = None  # Se não encontrou, define como None
-
-                # Descontos Incondicionados e Condicionados
-                match = re.search(r"Desconto Incondicionado\s*R\$\s*([\d,\.]+)", text)
-                if match:
-                    dados_nf["Desconto Incondicionado"] = match.group(1).strip()
-                else:
-                    dados_nf["Desconto Incondicionado"] = None
-                match = re.search(r"Desconto Condicionado\s*R\$\s*([\d,\.]+)", text)
-                if match:
-                    dados_nf["Desconto Condicionado"] = match.group(1).strip()
-                else:
-                    dados_nf["Desconto Condicionado"] = None
-
-                # Retenção Federal
-                match = re.search(r"Retenções Federais\s*R\$\s*([\d,\.]+)", text)
-                if match:
-                    dados_nf["Retencao Federal"] = match.group(1).strip()
-                else:
-                    dados_nf["Retencao Federal"] = None
-
-                # ISSQN Retido
-                match = re.search(r"ISSQN Retido\s*R\$\s*([\d,\.]+)", text)
-                if match:
-                    dados_nf["ISSQN Retido"] = match.group(1).strip()
-                else:
-                    dados_nf["ISSQN Retido"] = None
-
-                # Valor Líquido
-                match = re.search(r"Valor Líquido\s*R\$\s*([\d,\.]+)", text)
-                if match:
-                    dados_nf["Valor Liquido"] = match.group(1).strip()
-                else:
-                    dados_nf["Valor Liquido"] = None
-
-                # Regime Especial de Tributação
-                match = re.search(r"Regime Especial Tributação\s*(.+)", text)
-                if match:
-                    dados_nf["Regime Especial Tributacao"] = match.group(1).strip()
-
-                # Simples Nacional
-                match = re.search(r"Opção Simples Nacional\s*(.+)", text)
-                if match:
-                    dados_nf["Simples Nacional"] = match.group(1).strip()
-
-                # Incentivador Cultural
-                match = re.search(r"Incentivador Cultural\s*(.+)", text)
-                if match:
-                    dados_nf["Incentivador Cultural"] = match.group(1).strip()
-
-                # Avisos
-                match = re.search(r"Avisos\s*(.+)", text)
-                if match:
-                    dados_nf["Avisos"] = match.group(1).strip()
-                    
-    finally:
-        os.unlink(tmp_file_path)
-
-    return dados_nf
-
-def to_excel(df):
-    """Convert dataframe to excel file and encode it for download"""
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False)
-    excel_data = output.getvalue()
-    b64 = base64.b64encode(excel_data).decode('utf-8')
-    return b64
-
 def main():
     st.header(" 📝 Extrator de Notas Fiscais de serviço")
 
@@ -310,14 +68,56 @@ def main():
                 accept_multiple_files=True
             )
 
+            workers = st.number_input(
+                "Processos paralelos",
+                min_value=1,
+                max_value=os.cpu_count() or 1,
+                value=os.cpu_count() or 1,
+                help="Número de núcleos usados na extração dos PDFs"
+            )
+
+            with st.expander("Opções para PDFs com anexos"):
+                early_exit = st.checkbox(
+                    "Parar a leitura ao encontrar os campos principais",
+                    value=False,
+                    help="As páginas seguintes (anexos) não são lidas depois que número, data, prestador e valores forem encontrados"
+                )
+                max_pages = st.number_input(
+                    "Máximo de páginas por PDF (0 = todas)",
+                    min_value=0,
+                    value=0
+                )
+
+            backend = st.selectbox(
+                "Leitor de texto",
+                ['auto', 'pdfium', 'pdfplumber'],
+                help="auto: PDFium (rápido), refazendo com o pdfplumber quando algum campo principal não for encontrado"
+            )
+
+            use_cache = st.checkbox(
+                "Reutilizar NFs já processadas (cache)",
+                value=True,
+                help="PDFs com conteúdo idêntico a uploads anteriores não são processados novamente"
+            )
+
         if uploaded_files:
             with st.spinner('Processando os arquivos...'):
-                dados_extraidos = []
                 progress_bar = st.progress(0)
-                for i, pdf_file in enumerate(uploaded_files):
-                    dados_nf = extrair_dados_nf(pdf_file)
-                    dados_extraidos.append(dados_nf)
-                    progress_bar.progress((i + 1) / len(uploaded_files))
+                cache = ContentCache(NFSE_CACHE_NAMESPACE, NFSE_CACHE_VERSION, NFSE_CACHE_MAX_BYTES) if use_cache else None
+                with cache or nullcontext():
+                    dados_extraidos, avisos = extract_nfse_batch(
+                        [(pdf_file.name, pdf_file.getvalue()) for pdf_file in uploaded_files],
+                        workers=int(workers),
+                        progress=lambda done, total: progress_bar.progress(done / total),
+                        cache=cache,
+                        max_pages=int(max_pages) or None,
+                        early_exit=early_exit,
+                        backend=backend
+                    )
+                if cache is not None and not cache.available:
+                    st.warning(f"Cache indisponível, PDFs processados sem cache: {cache.error}")
+                for aviso in avisos:
+                    st.warning(aviso)
                     
                 df_nf = pd.DataFrame(dados_extraidos)
                 
@@ -334,6 +134,10 @@ def main():
                         st.metric("Total de Arquivos", len(uploaded_files))
                     with col2_2:
                         st.metric("NFs Processadas", len(df_nf))
+                    # Páginas de NFs vindas do cache não foram lidas nesta execução
+                    st.metric("Páginas Lidas", int(df_nf.loc[~df_nf['Lido do Cache'], 'Paginas Processadas'].sum()))
+                    if cache is not None:
+                        st.metric("NFs reaproveitadas do cache", cache.hits)
                     
                     if not df_nf.empty:
                         st.metric("Período", 
@@ -342,12 +146,15 @@ def main():
 
                 st.session_state['df_nf'] = df_nf
                 
-                excel_file = to_excel(df_nf)
-                st.download_button(
+                # O Excel só é gerado quando o usuário solicita o download
+                deferred_download_button(
+                    key='pdf_excel',
+                    version=dataset_version(uploaded_files_version(uploaded_files), int(max_pages), early_exit, backend),
+                    build=lambda: to_excel_bytes(df_nf),
                     label="📥 Baixar Excel",
-                    data=base64.b64decode(excel_file),
                     file_name="notas_fiscais_extraidas.xlsx",
-                    mime="application/vnd.ms-excel"
+                    mime="application/vnd.ms-excel",
+                    prepare_label="📄 Preparar Excel"
                 )
 
     with tabs[1]:
@@ -389,11 +196,11 @@ def main():
                     st.metric("Total de NFs", len(df_filtered))
                 with met_col2:
                     if 'Valor do Servico' in df_filtered.columns:
-                        total_valor = df_filtered['Valor do Servico'].apply(convert_brazilian_number).sum()
+                        total_valor = parse_brl_number(df_filtered['Valor do Servico']).sum()
                         st.metric("Valor Total", f"R$ {total_valor:,.2f}")
                 with met_col3:
                     if 'Valor Liquido' in df_filtered.columns:
-                        total_liquido = df_filtered['Valor Liquido'].apply(convert_brazilian_number).sum()
+                        total_liquido = parse_brl_number(df_filtered['Valor Liquido']).sum()
                         st.metric("Valor Líquido Total", f"R$ {total_liquido:,.2f}")
             
             # Display filtered data below metrics
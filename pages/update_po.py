@@ -2,12 +2,16 @@ import pandas as pd
 import streamlit as st
 import time
 from datetime import datetime
-import io
+import os
 import gc
 import logging
 from typing import List, Tuple, Optional, Dict, Any
 import numpy as np
-import base64
+import polars as pl
+from utils.aggregate import add_group_sums
+from utils.br_format import format_brl_currency
+from utils.excel_reader import read_excel_files
+from utils.export import deferred_download_button, to_excel_bytes
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -16,7 +20,24 @@ logger = logging.getLogger(__name__)
 # Constants
 MAX_UPLOAD_SIZE_MB = 200
 BYTES_PER_MB = 1024 * 1024
-CHUNK_SIZE = 10000  # Number of rows to process at once
+PROCESSING_ENGINES = ['pandas', 'polars']
+DEFAULT_ENGINE = 'pandas'
+NUMERIC_COLUMNS = ['Net order value', 'Order Quantity', 'PBXX Condition Amount']
+# The Polars engine sums in a different order than pandas, so its per-PO totals are rounded
+# (pandas results are left as they are); both engines can still differ by up to 1e-6 when
+# the two sums fall on either side of a rounding boundary
+TOTAL_COLUMNS = ['total_valor_po_liquido', 'total_valor_po_com_impostos', 'total_itens_po']
+TOTAL_DECIMALS = 6
+CURRENCY_COLUMNS = [
+    'valor_unitario', 'valor_item_com_impostos', 'Net order value',
+    'total_valor_po_liquido', 'total_valor_po_com_impostos'
+]
+DATE_COLUMNS = [
+    'Document Date', 'Delivery date', 'Last FUP', 
+    'Stat.-Rel. Del. Date', 'Delivery Date', 
+    'Requisition Date', 'Inspection Request Date',
+    'First Delivery Date', 'Purchase Requisition Delivery Date'
+]
 
 # Colunas selecionadas para salvar no arquivo final
 SELECTED_COLUMNS = [
@@ -58,84 +79,91 @@ SELECTED_COLUMNS = [
     'unique'
 ]
 
+# Colunas lidas dos arquivos Excel (as demais colunas da exportação do SAP são descartadas na leitura)
+INPUT_COLUMNS = [col for col in SELECTED_COLUMNS if not col.endswith('_formatted')] + ['PBXX Condition Amount']
+# Columns shown in the data tab (one row per PO item)
+VIEW_COLUMNS = [
+    'Purchasing Document',
+    'Item',
+    'Supplier',
+    'Vendor Name',
+    'Material',
+    'Material Description',
+    'Order Quantity',
+    'Order Unit',
+    'Control Code (NCM)',
+    'Project Code',
+    'Andritz WBS Element',
+    'Cost Center',
+    'Document Date',
+    'PO Created by',
+    'Purchase Requisition',
+]
+
 class DataProcessor:
     """Class to handle all data processing operations"""
-    
-    @staticmethod
-    def format_currency(value: float) -> str:
-        """Format value as Brazilian currency"""
-        try:
-            if pd.isna(value) or value == '':
-                return "R$ 0,00"
-            
-            if isinstance(value, str):
-                value = float(value.replace('.', '').replace(',', '.'))
-            
-            value = float(value)
-            integer_part = int(value)
-            decimal_part = int((value - integer_part) * 100)
-            
-            formatted_integer = '{:,}'.format(integer_part).replace(',', '.')
-            return f"R$ {formatted_integer},{decimal_part:02d}"
-        except Exception as e:
-            logger.warning(f"Error formatting currency value {value}: {str(e)}")
-            return "R$ 0,00"
 
     @staticmethod
-    def safe_division(x: float, y: float) -> float:
-        """Safely perform division handling zero division"""
-        try:
-            return x / y if y != 0 else 0
-        except:
-            return 0
-
+    def build_view(df: pd.DataFrame) -> pd.DataFrame:
+        """Build the data tab view from the raw input: view columns, one row per PO item"""
+        view = df[VIEW_COLUMNS].copy()
+        view['unique'] = (
+            view['Purchasing Document'].astype(str) +
+            view['Item'].astype(str)
+        )
+        return view.drop_duplicates(subset=['unique'])
+    
     @staticmethod
     def process_chunk(df: pd.DataFrame) -> pd.DataFrame:
-        """Process a chunk of data"""
+        """Compute numeric and unit value columns for the whole frame (vectorized)"""
         try:
-            chunk_processed = df.copy()
+            df_processed = df.copy(deep=False)
             
-            numeric_columns = ['Net order value', 'Order Quantity', 'PBXX Condition Amount']
-            for col in numeric_columns:
-                if col in chunk_processed.columns:
-                    chunk_processed[col] = pd.to_numeric(chunk_processed[col], errors='coerce')
-                    chunk_processed[col] = chunk_processed[col].fillna(0)
+            for col in NUMERIC_COLUMNS:
+                if col in df_processed.columns:
+                    df_processed[col] = pd.to_numeric(df_processed[col], errors='coerce').fillna(0)
             
-            chunk_processed['valor_unitario'] = chunk_processed.apply(
-                lambda row: DataProcessor.safe_division(row['Net order value'], row['Order Quantity']),
-                axis=1
+            # Unit value is 0 when the quantity is zero (NaN quantities were filled with 0 above)
+            net_value = df_processed['Net order value'].to_numpy(dtype=float)
+            quantity = df_processed['Order Quantity'].to_numpy(dtype=float)
+            df_processed['valor_unitario'] = np.divide(
+                net_value, quantity, out=np.zeros(len(df_processed)), where=quantity != 0
             )
             
-            chunk_processed['valor_item_com_impostos'] = (
-                chunk_processed['PBXX Condition Amount'] * chunk_processed['Order Quantity']
+            df_processed['valor_item_com_impostos'] = (
+                df_processed['PBXX Condition Amount'] * df_processed['Order Quantity']
             )
             
-            return chunk_processed
+            return df_processed
             
         except Exception as e:
             logger.error(f"Error processing chunk: {str(e)}")
             raise
 
     @staticmethod
-    def process_dataframe(df: pd.DataFrame, progress_bar: Any) -> pd.DataFrame:
-        """Process the complete DataFrame with progress tracking"""
+    def parse_dates(values: pd.Series, output_format: Optional[str] = None, **kwargs) -> pd.Series:
+        """Parse dates once per distinct value (exports repeat a few thousand dates over many rows)"""
+        codes, uniques = pd.factorize(values)
+        parsed = pd.to_datetime(pd.Series(uniques, dtype=values.dtype), **kwargs)
+        if output_format is None:
+            parsed = parsed.to_numpy()
+            missing = np.datetime64('NaT')
+        else:
+            parsed = parsed.dt.strftime(output_format).to_numpy(dtype=object)
+            missing = np.nan
+        # Code -1 (missing value) picks the appended NaT/NaN
+        return pd.Series(np.append(parsed, missing)[codes], index=values.index, name=values.name)
+
+    @staticmethod
+    def process_dataframe(df: pd.DataFrame, progress_bar: Any, engine: str = 'pandas') -> pd.DataFrame:
+        """Process the complete DataFrame with progress tracking using the selected engine"""
+        if engine == 'polars':
+            return DataProcessor.process_dataframe_polars(df, progress_bar)
+        if engine != 'pandas':
+            raise ValueError(f"Unknown processing engine: {engine}")
         try:
-            chunk_size = CHUNK_SIZE
-            num_chunks = len(df) // chunk_size + 1
-            processed_chunks = []
-            
-            for i in range(num_chunks):
-                start_idx = i * chunk_size
-                end_idx = min((i + 1) * chunk_size, len(df))
-                chunk = df.iloc[start_idx:end_idx]
-                
-                processed_chunk = DataProcessor.process_chunk(chunk)
-                processed_chunks.append(processed_chunk)
-                
-                progress = (i + 1) / num_chunks
-                progress_bar.progress(progress)
-                
-            df_processed = pd.concat(processed_chunks, ignore_index=True)
+            df_processed = DataProcessor.process_chunk(df)
+            progress_bar.progress(0.5)
             
             df_processed['unique'] = (
                 df_processed['Purchasing Document'].astype(str) + 
@@ -143,45 +171,27 @@ class DataProcessor:
             )
             df_processed = df_processed.drop_duplicates(subset=['unique'])
             
-            groupby_cols = ['Purchasing Document']
-            df_processed['total_valor_po_liquido'] = df_processed.groupby(groupby_cols)['Net order value'].transform('sum')
-            df_processed['total_valor_po_com_impostos'] = df_processed.groupby(groupby_cols)['valor_item_com_impostos'].transform('sum')
-            df_processed['total_itens_po'] = df_processed.groupby(groupby_cols)['Order Quantity'].transform('sum')
+            df_processed = add_group_sums(df_processed, 'Purchasing Document', {
+                'total_valor_po_liquido': 'Net order value',
+                'total_valor_po_com_impostos': 'valor_item_com_impostos',
+                'total_itens_po': 'Order Quantity',
+            })
                         
             df_processed['Purchasing Document'] = pd.to_numeric(df_processed['Purchasing Document'], errors='coerce')
             df_processed = df_processed.dropna(subset=['Purchasing Document'])
             df_processed['Purchasing Document'] = df_processed['Purchasing Document'].astype(int)
             
-            df_processed['PO Creation Date'] = pd.to_datetime(df_processed['Document Date'], dayfirst=True)
-            df_processed = df_processed.sort_values(by='PO Creation Date', ascending=False)
+            df_processed['PO Creation Date'] = DataProcessor.parse_dates(df_processed['Document Date'], dayfirst=True)
             
-            currency_columns = [
-                'valor_unitario', 'valor_item_com_impostos', 'Net order value',
-                'total_valor_po_liquido', 'total_valor_po_com_impostos'
-            ]
-            
-            for col in currency_columns:
-                df_processed[f'{col}_formatted'] = df_processed[col].apply(DataProcessor.format_currency)
-            
-            date_columns = [
-                'Document Date', 'Delivery date', 'Last FUP', 
-                'Stat.-Rel. Del. Date', 'Delivery Date', 
-                'Requisition Date', 'Inspection Request Date',
-                'First Delivery Date', 'Purchase Requisition Delivery Date'
-            ]
+            # Keep only the output columns before sorting (SAP exports carry many unused columns).
+            # Stable sort: POs created on the same day keep the order of the input files.
+            source_columns = [col for col in SELECTED_COLUMNS if col in df_processed.columns]
+            df_processed = df_processed[source_columns].sort_values(
+                by='PO Creation Date', ascending=False, kind='stable'
+            )
             
-            for col in date_columns:
-                if col in df_processed.columns:
-                    df_processed[col] = pd.to_datetime(
-                        df_processed[col],
-                        format='%d/%m/%Y',
-                        dayfirst=True,
-                        errors='coerce'
-                    )
-                    df_processed[col] = df_processed[col].dt.strftime('%d/%m/%Y')
-                    
-            # Select only the desired columns
-            df_processed = df_processed[SELECTED_COLUMNS]        
+            df_processed = DataProcessor.format_output(df_processed)
+            progress_bar.progress(1.0)
                        
             return df_processed
         
@@ -189,6 +199,111 @@ class DataProcessor:
         except Exception as e:
             logger.error(f"Error in process_dataframe: {str(e)}")
             raise
+
+    @staticmethod
+    def _polars_text(values: pd.Series) -> pl.Series:
+        """Text of each value exactly as pandas astype(str) renders it"""
+        if pd.api.types.is_integer_dtype(values) or pd.api.types.is_bool_dtype(values):
+            return pl.from_pandas(values).cast(pl.Utf8)
+        return pl.Series(values.astype(str).to_numpy(), dtype=pl.Utf8)
+
+    @staticmethod
+    def process_dataframe_polars(df: pd.DataFrame, progress_bar: Any) -> pd.DataFrame:
+        """
+        Polars lazy-frame version of process_dataframe.
+
+        Only the key and value columns go through Polars, together with the row
+        position; the remaining output columns are gathered from the original
+        frame by position afterwards, so their dtypes and values are untouched
+        (Polars cannot hold the mixed-type object columns of Excel exports).
+        Totals are grouped on pandas' own factorization of the PO column, and
+        dates are parsed only for the rows that survive dedup and PO filtering,
+        as in the pandas path. Per-PO totals are rounded to TOTAL_DECIMALS
+        because the summation order differs from pandas; they agree with the
+        pandas totals to within 1e-6.
+        """
+        try:
+            key_text = DataProcessor._polars_text(df['Purchasing Document'])
+            frame = pl.DataFrame({
+                'row': np.arange(len(df)),
+                # Same grouping as pandas: 4500000001 and '4500000001' stay separate
+                'po_group': pd.factorize(df['Purchasing Document'])[0],
+                'po_number': pl.from_pandas(pd.to_numeric(df['Purchasing Document'], errors='coerce')),
+                'unique': key_text + DataProcessor._polars_text(df['Item']),
+                **{col: pl.from_pandas(pd.to_numeric(df[col], errors='coerce')) for col in NUMERIC_COLUMNS},
+            })
+            progress_bar.progress(0.5)
+
+            numeric = [
+                pl.col(col).fill_nan(0).fill_null(0) if frame.schema[col].is_float() else pl.col(col).fill_null(0)
+                for col in NUMERIC_COLUMNS
+            ]
+            net_value = pl.col('Net order value')
+            quantity = pl.col('Order Quantity')
+            result = (
+                frame.lazy()
+                .with_columns(numeric)
+                .with_columns(
+                    valor_unitario=pl.when(quantity != 0).then(net_value / quantity).otherwise(0.0),
+                    valor_item_com_impostos=pl.col('PBXX Condition Amount') * quantity,
+                )
+                .unique(subset='unique', keep='first', maintain_order=True)
+                .with_columns(
+                    total_valor_po_liquido=net_value.sum().over('po_group'),
+                    total_valor_po_com_impostos=pl.col('valor_item_com_impostos').sum().over('po_group'),
+                    total_itens_po=quantity.sum().over('po_group'),
+                )
+                .filter(pl.col('po_number').is_not_null())
+                .with_columns(pl.col('po_number').cast(pl.Int64).alias('Purchasing Document'))
+                .drop('po_group', 'po_number', 'PBXX Condition Amount')
+                .collect()
+            )
+
+            # Dates are parsed once per distinct value, only for the remaining rows (footer rows are gone)
+            document_dates = df['Document Date'].take(result['row'].to_numpy())
+            result = result.with_columns(
+                pl.from_pandas(DataProcessor.parse_dates(document_dates, dayfirst=True)).alias('PO Creation Date')
+            ).sort('PO Creation Date', descending=True, nulls_last=True, maintain_order=True)
+
+            rows = result['row'].to_numpy()
+            computed = [col for col in result.columns if col != 'row']
+            source_columns = [
+                col for col in SELECTED_COLUMNS if col in df.columns or col in computed
+            ]
+            df_processed = df[[col for col in source_columns if col not in computed]].take(rows)
+            for col in computed:
+                df_processed[col] = result[col].to_numpy()
+            df_processed = df_processed[source_columns]
+            for col in TOTAL_COLUMNS:
+                df_processed[col] = df_processed[col].round(TOTAL_DECIMALS)
+
+            df_processed = DataProcessor.format_output(df_processed)
+            progress_bar.progress(1.0)
+
+            return df_processed
+
+        except Exception as e:
+            logger.error(f"Error in process_dataframe_polars: {str(e)}")
+            raise
+
+    @staticmethod
+    def format_output(df_processed: pd.DataFrame) -> pd.DataFrame:
+        """Add the formatted currency columns, normalize dates and select the output columns"""
+        for col in CURRENCY_COLUMNS:
+            df_processed[f'{col}_formatted'] = format_brl_currency(df_processed[col], na_rep="R$ 0,00")
+        
+        for col in DATE_COLUMNS:
+            if col in df_processed.columns:
+                df_processed[col] = DataProcessor.parse_dates(
+                    df_processed[col],
+                    format='%d/%m/%Y',
+                    dayfirst=True,
+                    errors='coerce',
+                    output_format='%d/%m/%Y'
+                )
+                
+        # Select only the desired columns
+        return df_processed[SELECTED_COLUMNS]
              
 class FileHandler:
     """Class to handle file operations"""
@@ -199,23 +314,9 @@ class FileHandler:
         return sum(file.size for file in files) / BYTES_PER_MB
 
     @staticmethod
-    def to_excel(df: pd.DataFrame) -> str:
-        """Convert DataFrame to Excel file and return as base64 string"""
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False)
-        excel_data = output.getvalue()
-        b64 = base64.b64encode(excel_data).decode()
-        return b64
-
-    @staticmethod
-    def read_excel_file(file: Any) -> Optional[pd.DataFrame]:
-        """Safely read Excel file"""
-        try:
-            return pd.read_excel(file, engine='openpyxl')
-        except Exception as e:
-            logger.error(f"Error reading file {file.name}: {str(e)}")
-            return None
+    def to_excel(df: pd.DataFrame) -> bytes:
+        """Convert DataFrame to Excel file bytes, streaming rows to a temp file (constant memory)"""
+        return to_excel_bytes(df)
 
 def clear_session_state():
     """Clear all session state variables"""
@@ -223,27 +324,6 @@ def clear_session_state():
         del st.session_state[key]
     gc.collect()
 
-def get_download_link(b64_data: str, filename: str) -> str:
-    """Generate HTML download link for Excel file with callback"""
-    href = f'data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64_data}'
-    return f'''
-        <a href="{href}" 
-           download="{filename}" 
-           class="downloadButton"
-           onclick="setTimeout(function(){{ window.location.href = window.location.pathname; }}, 1000);">
-           📥 Baixar Arquivo Excel Processado
-        </a>
-        <script>
-            window.addEventListener('load', function() {{
-                document.querySelector('.downloadButton').addEventListener('click', function() {{
-                    setTimeout(function() {{
-                        window.location.reload();
-                    }}, 1000);
-                }});
-            }});
-        </script>
-    '''
-
 def main():
     """Main application function"""
     st.set_page_config(
@@ -253,38 +333,13 @@ def main():
         initial_sidebar_state="collapsed"
     )
     
-    # Add custom CSS for download button
-    st.markdown("""
-        <style>
-        .downloadButton {
-            background-color: #0075be;
-            color: white !important;
-            padding: 0.5em 1em;
-            text-decoration: none;
-            border-radius: 5px;
-            border: none;
-            display: inline-block;
-            width: 100%;
-            text-align: center;
-            margin: 1em 0;
-            font-weight: 500;
-        }
-        .downloadButton:hover {
-            background-color: #4098ce;
-            color: white !important;
-            text-decoration: none;
-        }
-        </style>
-    """, unsafe_allow_html=True)
-    
     # Initialize session state
     if 'initialized' not in st.session_state:
         clear_session_state()
         st.session_state.initialized = True
         st.session_state.processed_data = None
+        st.session_state.view_data = None
         st.session_state.download_filename = None
-        st.session_state.excel_data = None
-        st.session_state.download_triggered = False
     
     st.header("📑 Sistema de Processamento de Pedidos de Compra")
     #st.subheader("📁 Seleção de Arquivos")
@@ -315,6 +370,12 @@ def main():
                     value=f"{remaining_size:.1f}MB"
                 )
         if uploaded_files:
+            engine = st.selectbox(
+                "Motor de processamento",
+                PROCESSING_ENGINES,
+                index=PROCESSING_ENGINES.index(DEFAULT_ENGINE),
+                help="Pandas é o processamento padrão; Polars (experimental) processa os dados em paralelo."
+            )
             if st.button("🚀 Iniciar Processamento", use_container_width=True, type="primary"):
                 try:
                     timestamp = datetime.now().strftime("%d%m%Y_%H%M%S")
@@ -323,31 +384,34 @@ def main():
                         status_placeholder = st.empty()
                         
                         start_time = time.time()
-                        all_dfs = []
+                        def report_progress(done, total, file_name):
+                            status_placeholder.info(f"Arquivo lido: {file_name}")
+                            progress_bar.progress(done / total)
                         
-                        for idx, uploaded_file in enumerate(uploaded_files):
-                            status_placeholder.info(f"Processando: {uploaded_file.name}")
-                            df_temp = FileHandler.read_excel_file(uploaded_file)
-                            
-                            if df_temp is not None and not df_temp.empty:
-                                all_dfs.append(df_temp)
-                            
-                            progress_bar.progress((idx + 1) / len(uploaded_files))
+                        # Files are read in parallel processes, loading only the input columns
+                        all_dfs, read_errors = read_excel_files(
+                            [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files],
+                            columns=INPUT_COLUMNS,
+                            workers=os.cpu_count() or 1,
+                            progress=report_progress
+                        )
+                        for error in read_errors:
+                            logger.error(error)
+                            st.warning(f"⚠️ {error}")
+                        all_dfs = [df_temp for df_temp in all_dfs if df_temp is not None and not df_temp.empty]
                         
                         if all_dfs:
                             df_final = pd.concat(all_dfs, ignore_index=True)
                             
-                            df = df_final 
+                            # The data tab view is kept in session state so it survives later reruns
+                            st.session_state.view_data = DataProcessor.build_view(df_final)
                             
-                            df_processed = DataProcessor.process_dataframe(df_final, progress_bar)
+                            df_processed = DataProcessor.process_dataframe(df_final, progress_bar, engine=engine)
                             
                             st.session_state.processed_data = df_processed
                             
                             st.session_state.download_filename = f'processamento_po_{timestamp}.xlsx'
                             
-                            # Convert to base64 and store in session state
-                            st.session_state.excel_data = FileHandler.to_excel(df_processed)
-                            
                             elapsed_time = time.time() - start_time
                             
                             st.success("✅ Processamento concluído com sucesso!")
@@ -365,13 +429,19 @@ def main():
                     logger.error(f"Error during processing: {str(e)}")
                     st.error(f"❌ Erro durante o processamento: {str(e)}")
         
-        if st.session_state.excel_data is not None:
+        if st.session_state.processed_data is not None:
             st.subheader("📥 Download do Arquivo Processado")
-            download_link = get_download_link(
-                st.session_state.excel_data,
-                st.session_state.download_filename
+            # The Excel file is only built when requested, once per processing run
+            processed_data = st.session_state.processed_data
+            deferred_download_button(
+                key='po_excel',
+                version=st.session_state.download_filename,
+                build=lambda: FileHandler.to_excel(processed_data),
+                label="📥 Baixar Arquivo Excel Processado",
+                file_name=st.session_state.download_filename,
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                prepare_label="📄 Gerar Arquivo Excel"
             )
-            st.markdown(download_link, unsafe_allow_html=True)
 
             # Add a button to manually clear the cache and return to initial state
             if st.button("🔄 Limpar e Voltar ao Início", use_container_width=True):
@@ -379,37 +449,8 @@ def main():
                 st.rerun()
                 
     with tab2:
-       if st.session_state.excel_data is not None:
-                 
-            df=df[['Purchasing Document',
-                'Item',
-                'Supplier',
-                'Vendor Name',
-                'Material',
-                'Material Description',
-                'Order Quantity',
-                'Order Unit',
-                'Control Code (NCM)',
-                'Project Code',
-                'Andritz WBS Element',
-                'Cost Center',
-                'Document Date', 
-                # 'PO Creation Date',
-                'PO Created by',
-                'Purchase Requisition',
-                # 'total_itens_po',
-                # 'valor_unitario_formatted', 
-                # 'total_valor_po_liquido_formatted', 
-                # 'total_valor_po_com_impostos_formatted',
-                # 'Order Quantity',
-                # 'total_itens_po',
-                # 'unique'
-                ]]
-            df['unique'] = (
-                df['Purchasing Document'].astype(str) + 
-                df['Item'].astype(str)
-            )
-            df = df.drop_duplicates(subset=['unique'])
+       if st.session_state.get('view_data') is not None:
+            df = st.session_state.view_data
             #st.dataframe(df)
             st.header("Visualização de Dados")
                     # Key Metrics
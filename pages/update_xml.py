@@ -1,14 +1,22 @@
 import streamlit as st
 import pandas as pd
 import os
-import xml.etree.ElementTree as ET
 from datetime import date
 import re
 import time
 import pickle
 import numpy as np
-import io
-import unicodedata
+from itertools import islice
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from utils.nfe_xml import NFE_COLUMNS, NFE_LAYOUT_VERSION, iter_xml_files, parse_nfe, parse_nfe_bytes
+from utils.content_cache import ContentCache
+from utils.slug import build_unique_key
+from utils.aggregate import add_group_sums
+from utils.br_format import shift_decimal
+from utils.export import (
+    deferred_download_button, to_arrow_ipc_bytes, to_excel_bytes, to_parquet_bytes, uploaded_files_version
+)
 #format_date_to_brazilian
 #df['Mês']
 # Page configuration
@@ -22,33 +30,6 @@ st.set_page_config(
 # Main title
 st.header("📃 Processamento de Arquivos XML")
 
-def slugify(text):
-    """
-    Convert a text string into a slug format.
-    - Convert to lowercase
-    - Remove special characters
-    - Replace spaces with hyphens
-    - Remove consecutive hyphens
-    """
-    if not isinstance(text, str):
-        text = str(text)
-    
-    # Convert to lowercase and normalize unicode characters
-    text = text.lower()
-    text = unicodedata.normalize('NFKD', text)
-    text = text.encode('ascii', 'ignore').decode('utf-8')
-    
-    # Replace any non-alphanumeric character with a hyphen
-    text = re.sub(r'[^a-z0-9]+', '-', text)
-    
-    # Remove leading and trailing hyphens
-    text = text.strip('-')
-    
-    # Replace multiple consecutive hyphens with a single hyphen
-    text = re.sub(r'-+', '-', text)
-    
-    return text
-
 def clean_description(description):
     """Remove múltiplos espaços consecutivos e espaços no início e no final da string."""
     if description is None:
@@ -68,163 +49,202 @@ def filter_info_adic(info_adic):
         return ' '.join(palavras_filtradas)
     return ""
 
-def format_value(value_str):
-    """Formata o valor substituindo vírgulas por pontos e convertendo para float se possível."""
-    if isinstance(value_str, str):
-        value_str = value_str.replace('.', '').replace(',', '.')
-        try:
-            return float(value_str)
-        except ValueError:
-            return value_str
-    elif isinstance(value_str, (int, float)):
-        return value_str
-    return ""
+# Tabelas de CFOP usadas na categorização das transações
+# Manutenção, Conserto e Reparo CFOPs
+MANUTENCAO_CFOPS = ['1915', '2915', '1916', '2916',   # Entrada para reparo
+                    '5915', '6915', '5916', '6916']   # Saída para reparo
+
+# Retorno de mercadoria CFOPs
+RETORNO_CFOPS = ['1201', '1202', '1203', '1204', '1410', '1411', '1503', '1504',
+                 '2201', '2202', '2203', '2204', '2410', '2411', '2503', '2504',
+                 '5201', '5202', '5210', '5410', '5411', '5412', '5413', '5503', '5504',
+                 '6201', '6202', '6210', '6410', '6411', '6412', '6413', '6503', '6504']
+
+# Remessa CFOPs
+REMESSA_CFOPS = ['1554', '1901', '1902', '1903', '1904', '1905', '1906', '1907', '1908', '1909', '1913', '1914', '1921',
+                 '2901', '2902', '2903', '2904', '2905', '2906', '2907', '2908', '2909', '2913', '2914', '2921',
+                 '5901', '5902', '5903', '5904', '5905', '5906', '5907', '5908', '5909', '5913', '5914', '5921',
+                 '6901', '6902', '6903', '6904', '6905', '6906', '6907', '6908', '6909', '6913', '6914', '6921']
+
+# Devolução CFOPs
+DEVOLUCAO_CFOPS = ['1201', '1202', '1203', '1204', '1209', '1410', '1411', '1503', '1504', '1921',
+                   '2201', '2202', '2203', '2204', '2209', '2410', '2411', '2503', '2504', '2921',
+                   '5201', '5202', '5203', '5204', '5209', '5410', '5411', '5412', '5413', '5503', '5504', '5921',
+                   '6201', '6202', '6203', '6204', '6209', '6410', '6411', '6412', '6413', '6503', '6504', '6921']
+
+# Industrialização CFOPs
+INDUSTRIALIZACAO_CFOPS = ['1124', '1125', '1126', '2124', '2125', '2126',
+                          '5124', '5125', '5126', '6124', '6125', '6126']
+
+# Ordem de prioridade das categorias (a primeira lista que contém o CFOP vence)
+CFOP_CATEGORY_PRIORITY = [
+    ("Manutenção/Conserto/Reparo", MANUTENCAO_CFOPS),
+    ("Retorno de Mercadoria", RETORNO_CFOPS),
+    ("Remessa", REMESSA_CFOPS),
+    ("Devolução", DEVOLUCAO_CFOPS),
+    ("Industrialização", INDUSTRIALIZACAO_CFOPS),
+]
+CFOP_CATEGORIES = {
+    cfop: categoria
+    for categoria, cfops in reversed(CFOP_CATEGORY_PRIORITY)
+    for cfop in cfops
+}
+
+# CFOP -> (categoria quando o emitente é Andritz, categoria caso contrário)
+MY_CFOP_CATEGORY_PRIORITY = [
+    (("Manutenção/Conserto/Reparo - Envio", "Manutenção/Conserto/Reparo - Retorno"),
+     ['5915', '5901', '6915']),
+    (("Transferência Entre Filiais - venda", "Venda de Terceiros"),
+     ['5101', '5102', '5401', '5403', '5405', '5551', '5653', '5656', '6101', '6102', '6107', '6108',
+      '6401', '6403', '6404', '5923', '6653', '6923']),
+    (("Transferência Entre Filiais - Retorno", "Manutenção/Conserto/Reparo - Retorno"),
+     ['1949', '2554', '2908', '2949']),
+    (("Transferência Entre Filiais - Envio", "Manutenção/Conserto/Reparo - Envio"),
+     ['6949', '5554', '6554', '6555']),
+]
+MY_CFOP_CATEGORIES = {
+    cfop: categorias
+    for categorias, cfops in reversed(MY_CFOP_CATEGORY_PRIORITY)
+    for cfop in cfops
+}
+
+def cfop_codes(cfop):
+    """Fatoriza a coluna de CFOP, retornando os códigos por linha e os valores únicos como texto."""
+    codes, uniques = pd.factorize(cfop, use_na_sentinel=False)
+    return codes, pd.Series(uniques, dtype=cfop.dtype).astype(str)
+
+def andritz_emitter_mask(emit_nome):
+    """Retorna uma máscara booleana indicando se o emitente é uma empresa Andritz."""
+    codes, uniques = pd.factorize(emit_nome, use_na_sentinel=False)
+    is_andritz = pd.Series(uniques, dtype=object).astype(str).str.upper().str.contains('ANDRITZ', regex=False)
+    return is_andritz.to_numpy(dtype=bool)[codes]
+
+def categorize_transactions(cfop, is_andritz_emitter):
+    """
+    Categoriza as transações com base no CFOP e se a Andritz é a emitente.
+    Inclui categorias para manutenção, reparos e retornos.
+    """
+    codes, uniques = cfop_codes(cfop)
+    categoria = uniques.map(CFOP_CATEGORIES).to_numpy(dtype=object)[codes]
+    first_digit = uniques.str[:1].to_numpy(dtype=object)[codes]
+
+    is_entrada = np.isin(first_digit, ['1', '2'])
+    is_saida = np.isin(first_digit, ['5', '6'])
+    fallback = np.select(
+        [
+            np.isin(first_digit, ['3', '7']),
+            (is_entrada | is_saida) & is_andritz_emitter,
+            is_entrada,
+            is_saida,
+        ],
+        [
+            "Importação/Exportação",
+            "Transferência Entre Filiais",
+            "Compra de Terceiros",
+            "Venda para Terceiros",
+        ],
+        default="Outros"
+    ).astype(object)
+
+    return pd.Series(np.where(pd.isna(categoria), fallback, categoria), index=cfop.index)
+
+def categorize_my(cfop, is_andritz_emitter):
+    """Categoriza as transações pelas listas de CFOP de envio/retorno, considerando se a Andritz é a emitente."""
+    codes, uniques = cfop_codes(cfop)
+    andritz = uniques.map({k: v[0] for k, v in MY_CFOP_CATEGORIES.items()}).fillna("Outros").to_numpy(dtype=object)
+    terceiros = uniques.map({k: v[1] for k, v in MY_CFOP_CATEGORIES.items()}).fillna("Outros").to_numpy(dtype=object)
+    return pd.Series(np.where(is_andritz_emitter, andritz[codes], terceiros[codes]), index=cfop.index)
+
+# Número de arquivos XML enviados por vez a cada processo de trabalho
+XML_CHUNK_SIZE = 16
+# Cache persistente das notas já processadas (indexado pelo SHA-256 do XML); as linhas
+# seguem a ordem de NFE_COLUMNS, então a versão acompanha o layout da extração
+XML_CACHE_NAMESPACE = 'nfe_xml'
+XML_CACHE_VERSION = NFE_LAYOUT_VERSION
+XML_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Modo de geração da coluna 'unique': 'slug' (legível) ou 'hash' (mais rápido)
+UNIQUE_KEY_MODE = 'slug'
+
+# Formatos de download disponíveis: função de conversão, nome do arquivo e tipo MIME.
+# Parquet e Arrow IPC usam textos codificados como dicionário e compressão zstd.
+EXPORT_FORMATS = {
+    "Excel": (
+        lambda df: to_excel_bytes(df, sheet_name='Invoices'),
+        "processed_invoices.xlsx",
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    ),
+    "Parquet": (to_parquet_bytes, "processed_invoices.parquet", "application/vnd.apache.parquet"),
+    "Arrow IPC": (to_arrow_ipc_bytes, "processed_invoices.arrow", "application/vnd.apache.arrow.file"),
+    "Pickle": (pickle.dumps, "processed_invoices.pkl", "application/octet-stream"),
+}
+
 
 class ReadXML:
-    def __init__(self, files):
+    def __init__(self, files, workers=1, chunk_size=None, cache=None):
         self.files = files
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.processed_count = 0
 
     def nfe_data(self, xml_file):
         """Extrai dados da NFe de um arquivo XML e retorna uma lista de dados para cada item da nota fiscal."""
-        root = ET.parse(xml_file).getroot()
-        nsNFe = {"ns": "http://www.portalfiscal.inf.br/nfe"}
-        
-# Acessar o elemento <infNFe> e extrair o atributo Id
-        infNFe = root.find(".//ns:infNFe", nsNFe)
-        if infNFe is not None:
-            chNFe = infNFe.attrib.get('Id', '')
-        else:
-            chNFe = ""
-
-        
-        #Dados gerais
-        NFe = self.check_none(root.find("./ns:NFe/ns:infNFe/ns:ide/ns:nNF", nsNFe))
-        serie = self.check_none(root.find("./ns:NFe/ns:infNFe/ns:ide/ns:serie", nsNFe))
-        natOp = self.check_none(root.find("./ns:NFe/ns:infNFe/ns:ide/ns:natOp", nsNFe))
-        data_emissao = self.check_none(root.find("./ns:NFe/ns:infNFe/ns:ide/ns:dhEmi", nsNFe))
-        #data_emissao = f"{data_emissao[8:10]}/{data_emissao[5:7]}/{data_emissao[:4]}" if data_emissao else ""
-        info_adic = self.check_none(root.find("./ns:NFe/ns:infNFe/ns:infAdic/ns:infCpl", nsNFe))
-        dVenc = self.check_none(root.find("./ns:NFe/ns:infNFe/ns:cobr/ns:dup/ns:dVenc", nsNFe))
-        #dVenc = f"{dVenc[8:10]}/{dVenc[5:7]}/{dVenc[:4]}" if dVenc else ""
-        #dVenc = dVenc.replace("//", "")
-
-        # Dados Emitente
-        emit = root.find("./ns:NFe/ns:infNFe/ns:emit", nsNFe)
-        emit_data = {
-            'CNPJ Emitente': self.check_none(emit.find("ns:CNPJ", nsNFe)) if emit is not None else "",
-            'Nome Emitente': self.check_none(emit.find("ns:xNome", nsNFe)) if emit is not None else "",
-            'IE Emitente': self.check_none(emit.find("ns:IE", nsNFe)) if emit is not None else "",
-            'Endereco Emitente': {
-                'Logradouro': self.check_none(emit.find("ns:enderEmit/ns:xLgr", nsNFe)) if emit is not None else "",
-                'Número': self.check_none(emit.find("ns:enderEmit/ns:nro", nsNFe)) if emit is not None else "",
-                'Complemento': self.check_none(emit.find("ns:enderEmit/ns:complemento", nsNFe)) if emit is not None else "",
-                'Bairro': self.check_none(emit.find("ns:enderEmit/ns:xBairro", nsNFe)) if emit is not None else "",
-                'Município': self.check_none(emit.find("ns:enderEmit/ns:xMun", nsNFe)) if emit is not None else "",
-                'UF': self.check_none(emit.find("ns:enderEmit/ns:UF", nsNFe)) if emit is not None else "",
-                'CEP': self.check_none(emit.find("ns:enderEmit/ns:CEP", nsNFe)) if emit is not None else "",
-                'País': self.check_none(emit.find("ns:enderEmit/ns:cPais", nsNFe)) if emit is not None else ""
-            }
-        }
-
-        # Dados Destinatário
-        dest = root.find("./ns:NFe/ns:infNFe/ns:dest", nsNFe)
-        dest_data = {
-            'CNPJ Destinatário': self.check_none(dest.find("ns:CNPJ", nsNFe)) if dest is not None else "",
-            'Nome Destinatário': self.check_none(dest.find("ns:xNome", nsNFe)) if dest is not None else "",
-            'IE Destinatário': self.check_none(dest.find("ns:IE", nsNFe)) if dest is not None else "",
-            'Endereco Destinatário': {
-                'Logradouro': self.check_none(dest.find("ns:enderDest/ns:xLgr", nsNFe)) if dest is not None else "",
-                'Número': self.check_none(dest.find("ns:enderDest/ns:nro", nsNFe)) if dest is not None else "",
-                'Complemento': self.check_none(dest.find("ns:enderDest/ns:complemento", nsNFe)) if dest is not None else "",
-                'Bairro': self.check_none(dest.find("ns:enderDest/ns:xBairro", nsNFe)) if dest is not None else "",
-                'Município': self.check_none(dest.find("ns:enderDest/ns:xMun", nsNFe)) if dest is not None else "",
-                'UF': self.check_none(dest.find("ns:enderDest/ns:UF", nsNFe)) if dest is not None else "",
-                'CEP': self.check_none(dest.find("ns:enderDest/ns:CEP", nsNFe)) if dest is not None else "",
-                'País': self.check_none(dest.find("ns:enderDest/ns:cPais", nsNFe)) if dest is not None else ""
-            }
-        }
-
-        # Dados Cobrança
-        cobr = root.find("./ns:NFe/ns:infNFe/ns:cobr", nsNFe)
-        cobr_data = self.extract_cobr_data(cobr, nsNFe) if cobr is not None else {}
-
-        # Dados do Item
-        itemNota = 1
-        notas = []
-
-        for item in root.findall("./ns:NFe/ns:infNFe/ns:det", nsNFe):
-            # Dados do Item
-            cod = self.check_none(item.find(".ns:prod/ns:cProd", nsNFe))
-            qntd = self.check_none(item.find(".ns:prod/ns:qCom", nsNFe))
-            descricao = self.check_none(item.find(".ns:prod/ns:xProd", nsNFe))
-            unidade_medida = self.check_none(item.find(".ns:prod/ns:uCom", nsNFe))
-            vlUnProd = self.check_none(item.find(".ns:prod/ns:vUnCom", nsNFe))
-            valorProd = self.check_none(item.find(".ns:prod/ns:vProd", nsNFe))
-            ncm = self.check_none(item.find(".ns:prod/ns:NCM", nsNFe))
-            cfop = self.check_none(item.find(".ns:prod/ns:CFOP", nsNFe))
-            xPed = self.check_none(item.find(".ns:prod/ns:xPed", nsNFe))
-            nItemPed = self.check_none(item.find(".ns:prod/ns:nItemPed", nsNFe))
-            infAdProd = self.check_none(item.find(".ns:infAdProd", nsNFe))
-
-            valorNfe = format_value(self.check_none(root.find("./ns:NFe/ns:infNFe/ns:total/ns:ICMSTot/ns:vNF", nsNFe)))
-            valor_frete = format_value(self.check_none(root.find("./ns:NFe/ns:infNFe/ns:total/ns:ICMSTot/ns:vFrete", nsNFe)))
-            data_importacao = self.check_none(root.find("./ns:NFe/ns:infNFe/ns:transp/ns:vol/ns:veicId", nsNFe))
-            usuario = self.check_none(root.find("./ns:NFe/ns:infNFe/ns:transp/ns:vol/ns:placa", nsNFe))
-            data_saida = self.check_none(root.find("./ns:NFe/ns:infNFe/ns:transp/ns:vol/ns:uf", nsNFe))
-
-            dados = [chNFe, NFe, serie, natOp, data_emissao, info_adic, dVenc, 
-                    emit_data['CNPJ Emitente'], emit_data['Nome Emitente'],
-                    dest_data['CNPJ Destinatário'], dest_data['Nome Destinatário'], valorNfe, valor_frete, itemNota, cod, qntd, descricao, unidade_medida, vlUnProd, valorProd, ncm, cfop , xPed, nItemPed,
-                    infAdProd, data_importacao, usuario, data_saida,
-                    cobr_data.get('Fatura', ''), cobr_data.get('Duplicata', ''), cobr_data.get('Valor Original', ''), cobr_data.get('Valor Pago', ''),
-                    emit_data['Endereco Emitente']['Logradouro'], emit_data['Endereco Emitente']['Número'], emit_data['Endereco Emitente']['Complemento'],
-                    emit_data['Endereco Emitente']['Bairro'], emit_data['Endereco Emitente']['Município'], emit_data['Endereco Emitente']['UF'],
-                    emit_data['Endereco Emitente']['CEP'], emit_data['Endereco Emitente']['País'],
-                    dest_data['Endereco Destinatário']['Logradouro'], dest_data['Endereco Destinatário']['Número'],
-                    dest_data['Endereco Destinatário']['Complemento'], dest_data['Endereco Destinatário']['Bairro'],
-                    dest_data['Endereco Destinatário']['Município'], dest_data['Endereco Destinatário']['UF'],
-                    dest_data['Endereco Destinatário']['CEP'], dest_data['Endereco Destinatário']['País']]
-            
-            notas.append(dados)
-            itemNota += 1
-        
-        return notas
-
-    def check_none(self, var):
-        """Verifica se o elemento XML é None e retorna uma string vazia, caso contrário, retorna o texto do elemento."""
-        if var is None:
-            return ""
-        try:
-            return var.text.replace('.', '.') if var.text else ""
-        except:
-            return ""
-
-    def extract_cobr_data(self, cobr, nsNFe):
-        """Extrai os dados da seção <cobr>, incluindo <fat> e <dup>."""
-        if cobr is None:
-            return {
-                'Fatura': '',
-                'Duplicata': '',
-                'Valor Original': '',
-                'Valor Pago': ''
-            }
-        
-        cobr_data = {
-            'Fatura': self.check_none(cobr.find("ns:fat/ns:nFat", nsNFe)),
-            'Duplicata': self.check_none(cobr.find("ns:dup/ns:nDup", nsNFe)),
-            'Valor Original': format_value(self.check_none(cobr.find("ns:fat/ns:vOrig", nsNFe))),
-            'Valor Pago': format_value(self.check_none(cobr.find("ns:fat/ns:vLiq", nsNFe)))
-        }
-        return cobr_data
+        return parse_nfe(xml_file)
 
     def process_xml_files(self):
         """Processa todos os arquivos XML carregados"""
+        self.processed_count = 0
+        if self.workers > 1 or self.cache is not None:
+            return self.process_xml_files_batched()
         dados = []
-        for uploaded_file in self.files:
-            result = self.nfe_data(uploaded_file)
+        for xml_file in iter_xml_files(self.files):
+            result = self.nfe_data(xml_file)
             dados.extend(result)
+            self.processed_count += 1
         return dados
 
+    def process_xml_files_batched(self):
+        """Processa os arquivos em lotes, consultando o cache e usando um pool de processos quando configurado."""
+        chunk_size = self.chunk_size or XML_CHUNK_SIZE
+        # Envia os arquivos em janelas para limitar a memória ao ler membros de arquivos compactados
+        window = self.workers * chunk_size * 4
+        payloads = (xml_file.read() for xml_file in iter_xml_files(self.files))
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else nullcontext()
+        dados = []
+        with executor:
+            while True:
+                batch = list(islice(payloads, window))
+                if not batch:
+                    break
+                for result in self.parse_batch(batch, executor, chunk_size):
+                    dados.extend(result)
+                self.processed_count += len(batch)
+        return dados
+
+    def parse_batch(self, batch, executor, chunk_size):
+        """Extrai as linhas de um lote de XMLs na ordem recebida, processando apenas os que não estão no cache."""
+        results = [None] * len(batch)
+        keys = [None] * len(batch)
+        pending = []
+        for idx, data in enumerate(batch):
+            if self.cache is not None:
+                keys[idx] = self.cache.key(data)
+                results[idx] = self.cache.get(keys[idx])
+            if results[idx] is None:
+                pending.append(idx)
+
+        to_parse = [batch[idx] for idx in pending]
+        if isinstance(executor, ProcessPoolExecutor):
+            parsed = executor.map(parse_nfe_bytes, to_parse, chunksize=chunk_size)
+        else:
+            parsed = map(parse_nfe_bytes, to_parse)
+
+        for idx, rows in zip(pending, parsed):
+            results[idx] = rows
+            if self.cache is not None:
+                self.cache.put(keys[idx], rows)
+        return results
+
 def main():
     # # Page configuration
     # st.set_page_config(
@@ -243,8 +263,23 @@ def main():
         # File uploader for XML files
         uploaded_files = st.file_uploader(
             "Upload XML Files", 
-            type=['xml'], 
-            accept_multiple_files=True
+            type=['xml', 'zip', 'tar', 'gz', 'tgz'], 
+            accept_multiple_files=True,
+            help="Aceita arquivos XML avulsos (também .xml.gz) ou compactados em .zip/.tar.gz"
+        )
+
+        workers = st.number_input(
+            "Processos paralelos",
+            min_value=1,
+            max_value=os.cpu_count() or 1,
+            value=os.cpu_count() or 1,
+            help="Número de núcleos usados na leitura dos arquivos XML"
+        )
+
+        use_cache = st.checkbox(
+            "Reutilizar notas já processadas (cache)",
+            value=True,
+            help="Notas com conteúdo idêntico a uploads anteriores não são processadas novamente"
         )
 
         if uploaded_files:
@@ -256,20 +291,22 @@ def main():
             progress_bar.empty()
 
             # Process XML files
-            xml_reader = ReadXML(uploaded_files)
-            dados = xml_reader.process_xml_files()
+            if use_cache:
+                with ContentCache(XML_CACHE_NAMESPACE, XML_CACHE_VERSION, XML_CACHE_MAX_BYTES) as cache:
+                    xml_reader = ReadXML(uploaded_files, workers=int(workers), cache=cache)
+                    dados = xml_reader.process_xml_files()
+
+                if not cache.available:
+                    st.warning(f"Cache indisponível, notas processadas sem cache: {cache.error}")
+                col_hits, col_misses = st.columns(2)
+                col_hits.metric("Notas reaproveitadas do cache", cache.hits)
+                col_misses.metric("Notas processadas", cache.misses)
+            else:
+                xml_reader = ReadXML(uploaded_files, workers=int(workers))
+                dados = xml_reader.process_xml_files()
 
     # Criando DataFrame Pandas
-            df = pd.DataFrame(dados, columns=[
-                'chaveNfe', 'NFe', 'Série', 'natOp','Data de Emissão', 'info_adic', 'dVenc', 'CNPJ Emitente', 'Nome Emitente',
-                'CNPJ Destinatário', 'Nome Destinatário', 'Valor NF-e', 'Valor Frete', 'Item Nota', 'Cód Produto',
-                'Quantidade', 'Descrição', 'Unidade Medida', 'vlUnProd', 'vlTotProd', 'ncm', 'cfop' ,'xPed', 'nItemPed',
-                'infAdProd', 'Data Importação', 'Usuário', 'Data Saída', 'Fatura', 'Duplicata', 'Valor Original', 'Valor Pago',
-                'Logradouro Emitente', 'Número Emitente', 'Complemento Emitente', 'Bairro Emitente', 'Município Emitente',
-                'UF Emitente', 'CEP Emitente', 'País Emitente', 'Logradouro Destinatário', 'Número Destinatário',
-                'Complemento Destinatário', 'Bairro Destinatário', 'Município Destinatário', 'UF Destinatário',
-                'CEP Destinatário', 'País Destinatário'
-            ])
+            df = pd.DataFrame(dados, columns=NFE_COLUMNS)
 
             colunas = [
                 'chaveNfe', 'NFe', 'Nome Emitente', 'Descrição', 'Série', 'natOp','Data de Emissão', 'info_adic', 'dVenc', 
@@ -285,8 +322,7 @@ def main():
             df = df.reindex(columns=colunas)
 
             # Create unique identifier using slugify
-            df['unique'] = df['NFe'].astype(str) + '-' + df['Item Nota'].astype(str) + '-' + df['Descrição'].astype(str)
-            df['unique'] = df['unique'].apply(slugify)
+            df['unique'] = build_unique_key([df['NFe'], df['Item Nota'], df['Descrição']], mode=UNIQUE_KEY_MODE)
             
             # Remove duplicates based on the slugified unique column
             df.drop_duplicates(subset='unique', inplace=True)
@@ -307,31 +343,14 @@ def main():
             # Converter as colunas para decimal (float) com duas casas decimais
             df = convert_to_decimal(df, columns_to_convert, decimal_places=2) 
             
-            # Função para formatar os números corretamente, lidando com valores vazios
-            def formatar_numero(x):
-                if pd.isna(x) or x == '':  # Se o valor for nulo ou string vazia
-                    return None  # Retorna None para manter o valor como NaN
-                else:
-                    x_str = str(int(x))  # Certificar que seja inteiro e sem pontos ou espaços
-                    
-                    # Garantindo que o número tenha pelo menos dois dígitos
-                    if len(x_str) > 2:
-                        # Inserindo o ponto decimal entre os dois últimos dígitos
-                        return x_str[:-2] + "." + x_str[-2:]
-                    else:
-                        # Se o número for menor que 100, apenas adiciona '0.xx'
-                        return "0." + x_str.zfill(2)
-
-
-            # Aplicar a função diretamente nas colunas existentes
+            # Os valores chegam em centavos (sem separador decimal): desloca duas casas decimais
             colunas_para_formatar = ['Valor NF-e', 'Valor Original', 'Valor Pago']
             
             for coluna in colunas_para_formatar:
-                # Formatar os números na coluna e converter para float
-                df[coluna] = df[coluna].apply(formatar_numero).astype(float)
+                df[coluna] = shift_decimal(df[coluna])
                     
-            # Agrupando por 'Category' e somando os valores de 'Value'
-            df['vlNf'] = df.groupby('chaveNfe')['vlTotProd'].transform('sum')
+            # Valor total dos produtos de cada nota, repetido em cada item
+            df = add_group_sums(df, 'chaveNfe', {'vlNf': 'vlTotProd'})
 
             df['Descrição'] = df['Descrição'].apply(clean_description).str.upper()
             
@@ -395,27 +414,6 @@ def main():
             # Aplicar a formatação desejada
             df = format_date_to_brazilian(df, ['dVenc'])
                                         
-            #Função para formatar colunas como moeda brasileira (BRL)
-            
-            def format_to_brl_currency(df, columns):
-                """
-                Formata as colunas especificadas do DataFrame para o formato de moeda brasileiro (Real) com duas casas decimais.
-                Valores não numéricos ou vazios são substituídos por uma string vazia.
-                
-                :param df: DataFrame a ser modificado
-                :param columns: Lista de nomes das colunas a serem formatadas
-                :return: DataFrame com as colunas formatadas como moeda brasileira
-                """
-                for column in columns:
-                    df[column] = pd.to_numeric(df[column], errors='coerce')
-
-                    #df[column] = df[column].apply(lambda x: f'R${x:,.2f}'.replace('.', ',') if pd.notna(x) else '')
-                    
-                    # Convertendo valores para formato desejado
-                    df[column] = df[column].apply(lambda x: 'R$ {:,.2f}'.format(x / 1))
-                    df[column] = df[column].str.replace(',', 'X').str.replace('.', ',').str.replace('X', '.')
-                return df
-
             df = df
                             
             def convert_columns_to_numeric(df, columns):
@@ -477,182 +475,10 @@ def main():
             po_invoice_counts.columns = ['po', 'total_invoices_per_po']
             df = df.merge(po_invoice_counts, on='po', how='left')
             
-            def categorize_transaction(row):
-                """
-                Categorize transactions based on CFOP and whether Andritz is the emitter
-                Includes categories for maintenance, repairs, and returns
-                """
-                cfop = str(row['cfop'])
-                emit_nome = str(row['emitNome']).upper()
-                
-                # Check if Andritz is the emitter
-                is_andritz_emitter = 'ANDRITZ' in emit_nome
-                
-                # Manutenção, Conserto e Reparo CFOPs
-                manutencao_entrada_cfops = ['1915', '2915', '1916', '2916']  # Entrada para reparo
-                manutencao_saida_cfops = ['5915', '6915', '5916', '6916']    # Saída para reparo
-                
-                # Retorno de mercadoria CFOPs
-                retorno_entrada_cfops = ['1201', '1202', '1203', '1204', '1410', '1411', '1503', '1504', 
-                                        '2201', '2202', '2203', '2204', '2410', '2411', '2503', '2504']
-                retorno_saida_cfops = ['5201', '5202', '5210', '5410', '5411', '5412', '5413', '5503', '5504',
-                                    '6201', '6202', '6210', '6410', '6411', '6412', '6413', '6503', '6504']
-                
-                # Remessa CFOPs
-                remessa_entrada_cfops = ['1554','1901', '1902', '1903', '1904', '1905', '1906', '1907', '1908', '1909', '1913', '1914', '1921',
-                                        '2901', '2902', '2903', '2904', '2905', '2906', '2907', '2908', '2909', '2913', '2914', '2921']
-                remessa_saida_cfops = ['5901', '5902', '5903', '5904', '5905', '5906', '5907', '5908', '5909', '5913', '5914', '5921',
-                                    '6901', '6902', '6903', '6904', '6905', '6906', '6907', '6908', '6909', '6913', '6914', '6921']
-                
-                # Devolução CFOPs
-                devolucao_entrada_cfops = ['1201', '1202', '1203', '1204', '1209', '1410', '1411', '1503', '1504', '1921',
-                                        '2201', '2202', '2203', '2204', '2209', '2410', '2411', '2503', '2504', '2921']
-                devolucao_saida_cfops = ['5201', '5202', '5203', '5204', '5209', '5410', '5411', '5412', '5413', '5503', '5504', '5921',
-                                        '6201', '6202', '6203', '6204', '6209', '6410', '6411', '6412', '6413', '6503', '6504', '6921']
-
-                # Industrialização CFOPs
-                industrializacao_entrada_cfops = ['1124', '1125', '1126', '2124', '2125', '2126']
-                industrializacao_saida_cfops = ['5124', '5125', '5126', '6124', '6125', '6126']
-
-                # Categorization logic
-                if cfop in manutencao_entrada_cfops or cfop in manutencao_saida_cfops:
-                    return "Manutenção/Conserto/Reparo"
-                
-                elif cfop in retorno_entrada_cfops or cfop in retorno_saida_cfops:
-                    return "Retorno de Mercadoria"
-                
-                elif cfop in remessa_entrada_cfops or cfop in remessa_saida_cfops:
-                    return "Remessa"
-                
-                elif cfop in devolucao_entrada_cfops or cfop in devolucao_saida_cfops:
-                    return "Devolução"
-                    
-                elif cfop in industrializacao_entrada_cfops or cfop in industrializacao_saida_cfops:
-                    return "Industrialização"
-                
-                elif cfop.startswith('3') or cfop.startswith('7'):
-                    return "Importação/Exportação"
-                    
-                elif cfop.startswith('1') or cfop.startswith('2'):  # Entrada
-                    if is_andritz_emitter:
-                        return "Transferência Entre Filiais"
-                    else:
-                        return "Compra de Terceiros"
-                        
-                elif cfop.startswith('5') or cfop.startswith('6'):  # Saída
-                    if is_andritz_emitter:
-                        return "Transferência Entre Filiais"
-                    else:
-                        return "Venda para Terceiros"
-                        
-                return "Outros"  # Default category
-
-            # Add this code after the existing DataFrame transformations but before the final column selection
-            df['categoria'] = df.apply(categorize_transaction, axis=1)
-            
-            def categorize(row):
-                """
-                Categorize transactions based on CFOP and whether Andritz is the emitter
-                Includes categories for maintenance, repairs, and returns
-                """
-                cfop = str(row['cfop'])
-                emit_nome = str(row['emitNome']).upper()
-                
-                # Check if Andritz is the emitter
-                is_andritz_emitter = 'ANDRITZ' in emit_nome
-                
-                # Manutenção, Conserto e Reparo CFOPs
-                manutencao_entrada_cfops = ['1915', '2915', '1916', '2916']  # Entrada para reparo
-                manutencao_saida_cfops = ['5915', '6915', '5916', '6916']    # Saída para reparo
-                
-                # Retorno de mercadoria CFOPs
-                retorno_entrada_cfops = ['1201', '1202', '1203', '1204', '1410', '1411', '1503', '1504', 
-                                        '2201', '2202', '2203', '2204', '2410', '2411', '2503', '2504']
-                retorno_saida_cfops = ['5201', '5202', '5210', '5410', '5411', '5412', '5413', '5503', '5504',
-                                    '6201', '6202', '6210', '6410', '6411', '6412', '6413', '6503', '6504']
-                
-                # Remessa CFOPs
-                remessa_entrada_cfops = ['1554','1901', '1902', '1903', '1904', '1905', '1906', '1907', '1908', '1909', '1913', '1914', '1921',
-                                        '2901', '2902', '2903', '2904', '2905', '2906', '2907', '2908', '2909', '2913', '2914', '2921']
-                remessa_saida_cfops = ['5901', '5902', '5903', '5904', '5905', '5906', '5907', '5908', '5909', '5913', '5914', '5921',
-                                    '6901', '6902', '6903', '6904', '6905', '6906', '6907', '6908', '6909', '6913', '6914', '6921']
-                
-                # Devolução CFOPs
-                devolucao_entrada_cfops = ['1201', '1202', '1203', '1204', '1209', '1410', '1411', '1503', '1504', '1921',
-                                        '2201', '2202', '2203', '2204', '2209', '2410', '2411', '2503', '2504', '2921']
-                devolucao_saida_cfops = ['5201', '5202', '5203', '5204', '5209', '5410', '5411', '5412', '5413', '5503', '5504', '5921',
-                                        '6201', '6202', '6203', '6204', '6209', '6410', '6411', '6412', '6413', '6503', '6504', '6921']
-
-                # Industrialização CFOPs
-                industrializacao_entrada_cfops = ['1124', '1125', '1126', '2124', '2125', '2126']
-                industrializacao_saida_cfops = ['5124', '5125', '5126', '6124', '6125', '6126']
-                
-                venda=['5101','5102','5401','5403','5405','5551','5653','5656','6101','6102','6107','6108','6401','6403','6404','5923','6653','6923']
-                transf_filiais_retorno=['1949','2554','2908','2949']
-                transf_filiais_envio=['6949','5554','6554','6555']
-                manutencao_envio=['5915','5901','6915']
-                
-
-
-
-                # Categorization logic
-                # if cfop in manutencao_entrada_cfops or cfop in manutencao_saida_cfops:
-                #     return "Manutenção/Conserto/Reparo"
-                
-                # elif cfop in retorno_entrada_cfops or cfop in retorno_saida_cfops:
-                #     return "Retorno de Mercadoria"
-                
-                # elif cfop in remessa_entrada_cfops or cfop in remessa_saida_cfops:
-                #     return "Remessa"
-                
-                # elif cfop in devolucao_entrada_cfops or cfop in devolucao_saida_cfops:
-                #     return "Devolução"
-                    
-                # elif cfop in industrializacao_entrada_cfops or cfop in industrializacao_saida_cfops:
-                #     return "Industrialização"
-                
-                # elif cfop.startswith('3') or cfop.startswith('7'):
-                #     return "Importação/Exportação"
-                    
-                # elif cfop.startswith('1') or cfop.startswith('2'):  # Entrada
-                #     if is_andritz_emitter:
-                #         return "Transferência Entre Filiais"
-                #     else:
-                #         return "Compra de Terceiros"
-                        
-                # elif cfop.startswith('5') or cfop.startswith('6'):  # Saída
-                #     if is_andritz_emitter:
-                #         return "Transferência Entre Filiais"
-                #     else:
-                #         return "Venda para Terceiros"
-                if cfop in manutencao_envio:  # Saída
-                    if is_andritz_emitter:
-                        return "Manutenção/Conserto/Reparo - Envio"
-                    else:
-                        return "Manutenção/Conserto/Reparo - Retorno"
-                    
-                elif cfop in venda:  # Saída
-                    if is_andritz_emitter:
-                        return "Transferência Entre Filiais - venda"
-                    else:
-                        return "Venda de Terceiros"
-                    
-                elif cfop in transf_filiais_retorno:  # Saída
-                    if is_andritz_emitter:
-                        return "Transferência Entre Filiais - Retorno"
-                    else:
-                        return "Manutenção/Conserto/Reparo - Retorno" 
-                    
-                elif cfop in transf_filiais_envio:  # Saída
-                    if is_andritz_emitter:
-                        return "Transferência Entre Filiais - Envio"
-                    else:
-                        return "Manutenção/Conserto/Reparo - Envio"  
-                                
-                return "Outros"  # Default category
-
-            # Add this code after the existing DataFrame transformations but before the final column selection
-            df['my_categoria'] = df.apply(categorize, axis=1)
+            # Categorização vetorizada por CFOP e emitente (tabelas de lookup pré-computadas)
+            is_andritz_emitter = andritz_emitter_mask(df['emitNome'])
+            df['categoria'] = categorize_transactions(df['cfop'], is_andritz_emitter)
+            df['my_categoria'] = categorize_my(df['cfop'], is_andritz_emitter)
 
                        
                             # Exibir apenas as colunas renomeadas
@@ -663,46 +489,25 @@ def main():
             
             df= df[colunas_renomeadas]
 
-            groupby_cols_nf = ['chNfe']
-            df['total_itens_nf'] = df.groupby(groupby_cols_nf )['qtd'].transform('sum')
-            
-            groupby_cols_po = ['po']
-            df['total_itens_po'] = df.groupby(groupby_cols_po )['qtd'].transform('sum')
-            df['valor_recebido_po'] = df.groupby(groupby_cols_po )['vlTotProd'].transform('sum')
+            df = add_group_sums(df, 'chNfe', {'total_itens_nf': 'qtd'})
+            df = add_group_sums(df, 'po', {'total_itens_po': 'qtd', 'valor_recebido_po': 'vlTotProd'})
                         
             df = df.sort_values(by=['dtEmi','nNf','itemNf'], ascending=[False,True,True])
 
-            # Download buttons
-            def convert_df_to_excel(df):
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Invoices')
-                return output.getvalue()
-
-            def convert_df_to_pickle(df):
-                return pickle.dumps(df)
-
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                excel_file = convert_df_to_excel(df)
-                st.download_button(
-                    label="Download Excel",
-                    data=excel_file,
-                    file_name="processed_invoices.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
-
-            with col2:
-                pickle_file = convert_df_to_pickle(df)
-                st.download_button(
-                    label="Download Pickle",
-                    data=pickle_file,
-                    file_name="processed_invoices.pkl",
-                    mime="application/octet-stream"
-                )
-
-            st.success(f"Processed {len(uploaded_files)} XML files")
+            # Download: o arquivo é gerado apenas para o formato solicitado e
+            # reaproveitado enquanto os arquivos enviados forem os mesmos
+            export_format = st.selectbox("Formato do download", list(EXPORT_FORMATS))
+            convert, file_name, mime = EXPORT_FORMATS[export_format]
+            deferred_download_button(
+                key=f'xml_{export_format}',
+                version=uploaded_files_version(uploaded_files),
+                build=lambda: convert(df),
+                label=f"Download {export_format}",
+                file_name=file_name,
+                mime=mime
+            )
+
+            st.success(f"Processed {xml_reader.processed_count} XML files")
     with tab2:
         st.header("Visualização de Dados")
         if 'df' in locals():
@@ -746,6 +551,7 @@ def main():
         1. **Carregue seus arquivos XML**
         - Clique em "Upload XML Files"
         - Selecione um ou mais arquivos XML de notas fiscais
+        - Também é possível enviar arquivos .zip ou .tar.gz com os XMLs exportados pelo ERP
 
         2. **Processamento Automático**
         - O aplicativo processará automaticamente os arquivos
@@ -753,7 +559,8 @@ def main():
 
         3. **Visualização dos Dados**
         - Os dados processados serão exibidos em uma tabela
-        - Você pode fazer download em formato Excel ou Pickle
+        - Escolha o formato (Excel, Parquet, Arrow IPC ou Pickle) e clique em "Preparar download"; o arquivo só é gerado nesse momento
+        - Parquet e Arrow IPC são os formatos recomendados para ferramentas de BI
 
         ### Recursos Principais 📊
 
@@ -771,6 +578,7 @@ def main():
 
         ### Formatos Suportados
         - Arquivos XML com estrutura de Nota Fiscal Eletrônica (NF-e)
+        - Arquivos .zip, .tar e .tar.gz contendo XMLs de NF-e
         """)
 
 if __name__ == "__main__":
@@ -1,10 +1,14 @@
 import streamlit as st
 import pandas as pd
-from pymongo import MongoClient, errors
+from pymongo import DeleteMany, MongoClient, ReplaceOne, errors
 import urllib.parse
 import numpy as np
 from datetime import datetime, time
 import time as time_module
+import random
+from itertools import islice
+import pyarrow as pa
+import pyarrow.compute as pc
 from contextlib import contextmanager
 
 # Configuração da página
@@ -63,74 +67,217 @@ CLUSTER = 'cluster0.akbb8.mongodb.net'
 DB_NAME = 'warehouse'
 MAX_RETRIES = 3
 RETRY_DELAY = 2
+RETRY_MAX_DELAY = 15
+
+# Pool de conexões do cliente compartilhado (um por processo do Streamlit)
+MONGO_MAX_POOL_SIZE = 20
+MONGO_MIN_POOL_SIZE = 1
+MONGO_MAX_IDLE_TIME_MS = 300000
+MONGO_CONNECT_TIMEOUT_MS = 10000
+MONGO_SOCKET_TIMEOUT_MS = 30000
+MONGO_SERVER_SELECTION_TIMEOUT_MS = 10000
+
+# Remoção de duplicatas no servidor: valores repetidos (um DeleteMany cada) por bulk_write
+DEDUP_DELETE_BATCH_SIZE = 1000
+
+# Códigos do MongoDB para índice já existente com outro nome/opções (IndexOptionsConflict, IndexKeySpecsConflict)
+INDEX_CONFLICT_CODES = (85, 86)
+
+@st.cache_resource(show_spinner=False)
+def get_mongo_client():
+    """
+    Cliente MongoDB compartilhado por todas as sessões e funções do processo.
+
+    O cliente é criado uma única vez e mantém o pool de conexões aberto entre
+    os reruns. A conexão é estabelecida sob demanda e o estado do servidor é
+    acompanhado pelo monitor do pymongo, sem ping a cada operação.
+    """
+    connection_string = f"mongodb+srv://{USERNAME}:{PASSWORD}@{CLUSTER}/?retryWrites=true&w=majority"
+    return MongoClient(
+        connection_string,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        retryReads=True
+    )
 
 @contextmanager
 def mongodb_connection():
-    """Context manager para conexão MongoDB com retry"""
-    client = None
+    """Context manager que fornece o banco de dados do cliente compartilhado (o cliente não é fechado)"""
+    yield get_mongo_client()[DB_NAME]
+
+def retry_delay(attempt):
+    """Espera antes da próxima tentativa: exponencial, limitada e com variação aleatória"""
+    return min(RETRY_MAX_DELAY, RETRY_DELAY * 2 ** attempt) * random.uniform(0.5, 1)
+
+def with_retry(operation, retry_on=(errors.AutoReconnect,)):
+    """
+    Executa operation(db) repetindo em falhas transitórias de conexão.
+
+    Por padrão repete em qualquer AutoReconnect (seleção de servidor, rede,
+    troca de primário), o que é seguro para leituras. Escritas não idempotentes
+    devem repetir apenas em ServerSelectionTimeoutError, quando nada foi enviado.
+    """
     for attempt in range(MAX_RETRIES):
         try:
-            connection_string = f"mongodb+srv://{USERNAME}:{PASSWORD}@{CLUSTER}/?retryWrites=true&w=majority&connectTimeoutMS=30000&socketTimeoutMS=30000"
-            client = MongoClient(connection_string, serverSelectionTimeoutMS=30000)
-            # Verifica a conexão
-            client.server_info()
-            yield client[DB_NAME]
-            break
-        except errors.ServerSelectionTimeoutError:
+            with mongodb_connection() as db:
+                return operation(db)
+        except retry_on:
             if attempt == MAX_RETRIES - 1:
                 raise
-            time_module.sleep(RETRY_DELAY)
-        except Exception as e:
-            raise
-        finally:
-            if client:
-                client.close()
-
-def handle_date(value):
-    """Função para tratar datas e horários"""
-    if pd.isna(value) or pd.isnull(value):
-        return None
-    if isinstance(value, pd.Timestamp):
-        return value.strftime('%Y-%m-%d %H:%M:%S')
+            time_module.sleep(retry_delay(attempt))
+
+def _mongo_scalar(value):
+    """Converte um valor isolado (numpy ou horário) para um tipo gravável no MongoDB"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
     if isinstance(value, time):
         return value.strftime('%H:%M:%S')
+    if isinstance(value, np.datetime64):
+        return str(value)
     return value
 
-def clean_dataframe(df):
-    """Limpa e prepara o DataFrame para inserção no MongoDB"""
-    df_clean = df.copy()
-    
-    for column in df_clean.columns:
-        if df_clean[column].dtype in ['datetime64[ns]', 'datetime64[ns, UTC]']:
-            df_clean[column] = df_clean[column].apply(handle_date)
-        else:
-            df_clean[column] = df_clean[column].apply(lambda x: 
-                None if pd.isna(x) 
-                else int(x) if isinstance(x, np.integer)
-                else float(x) if isinstance(x, np.floating)
-                else bool(x) if isinstance(x, np.bool_)
-                else x.strftime('%H:%M:%S') if isinstance(x, time)
-                else str(x) if isinstance(x, np.datetime64)
-                else x
-            )
-    
-    return df_clean
+def mongo_column_values(values):
+    """
+    Converte uma coluna para um array de valores Python prontos para o MongoDB.
+
+    A conversão é decidida uma vez pelo dtype da coluna: datas viram texto
+    "AAAA-MM-DD HH:MM:SS", números e booleanos viram int/float/bool do Python
+    e valores ausentes (NaN, NaT, NA) viram None. Em colunas de objetos, só as
+    células com tipos do numpy ou horários são convertidas uma a uma.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values.dtype):
+        if values.dt.tz is not None:
+            values = values.dt.tz_localize(None)
+        # O texto de um timestamp em segundos do Arrow já está no formato "AAAA-MM-DD HH:MM:SS"
+        seconds = pa.array(values.to_numpy(dtype='datetime64[s]'), from_pandas=True)
+        return pc.cast(seconds, pa.string()).to_numpy(zero_copy_only=False)
+
+    converted = values.astype(object).to_numpy(copy=True)
+    if not (isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biu'):
+        converted[values.isna().to_numpy()] = None
+
+    if values.dtype == object:
+        type_codes, types = pd.factorize(np.fromiter(map(type, converted), dtype=object, count=len(converted)))
+        for code, kind in enumerate(types):
+            if not issubclass(kind, (np.generic, time)):
+                continue
+            cells = type_codes == code
+            if issubclass(kind, time):
+                # Horários se repetem muito: cada horário distinto é formatado uma vez
+                codes, uniques = pd.factorize(converted[cells])
+                formatted = np.array([_mongo_scalar(value) for value in uniques], dtype=object)
+                converted[cells] = formatted[codes]
+            else:
+                converted[cells] = [_mongo_scalar(value) for value in converted[cells]]
+    return converted
+
+def iter_mongo_records(df):
+    """Gera um documento (dict) por linha do DataFrame, com as colunas convertidas por mongo_column_values"""
+    names = list(df.columns)
+    columns = [mongo_column_values(df.iloc[:, position]) for position in range(len(names))]
+    for row in zip(*columns):
+        yield dict(zip(names, row))
+
+def iter_batches(iterable, batch_size):
+    """Agrupa os itens em listas de até batch_size elementos"""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
 
 def upload_to_mongodb(df, collection_name):
     """Faz upload do DataFrame para o MongoDB com retry"""
     try:
-        with mongodb_connection() as db:
-            df_clean = clean_dataframe(df)
-            records = df_clean.to_dict('records')
-            collection = db[collection_name]
-            
-            # Upload em lotes para evitar timeout
-            batch_size = 1000
-            for i in range(0, len(records), batch_size):
-                batch = records[i:i + batch_size]
-                result = collection.insert_many(batch, ordered=False)
-            
-            return True, len(records)
+        # Upload em lotes para evitar timeout (documentos gerados sob demanda, lote a lote)
+        batch_size = 1000
+        total = 0
+        for batch in iter_batches(iter_mongo_records(df), batch_size):
+            result = with_retry(
+                lambda db: db[collection_name].insert_many(batch, ordered=False),
+                retry_on=(errors.ServerSelectionTimeoutError,)
+            )
+            total += len(batch)
+        
+        return True, total
+    except errors.ServerSelectionTimeoutError:
+        return False, "Erro de timeout na conexão com MongoDB. Por favor, tente novamente."
+    except Exception as e:
+        return False, f"Erro no upload: {str(e)}"
+
+def ensure_unique_index(collection_name, key_field):
+    """
+    Garante um índice único em key_field.
+
+    Um índice simples já existente na mesma chave, mas sem unique, é trocado
+    pelo índice único (o MongoDB não aceita dois índices com a mesma chave).
+    Se a troca falhar por valores repetidos, o índice original é recriado e o
+    DuplicateKeyError é repassado.
+    """
+    key = [(key_field, 1)]
+    indexes = with_retry(lambda db: db[collection_name].index_information())
+    for name, spec in indexes.items():
+        if list(spec['key']) != key:
+            continue
+        if spec.get('unique'):
+            return
+        with_retry(lambda db: db[collection_name].drop_index(name))
+        try:
+            with_retry(lambda db: db[collection_name].create_index(key, unique=True))
+        except errors.DuplicateKeyError:
+            with_retry(lambda db: db[collection_name].create_index(key, name=name))
+            raise
+        return
+    with_retry(lambda db: db[collection_name].create_index(key, unique=True))
+
+def upsert_to_mongodb(df, collection_name, key_field, batch_size=1000):
+    """
+    Envia o DataFrame atualizando os documentos existentes pela chave (upload idempotente).
+
+    Garante um índice único em key_field e grava cada linha com ReplaceOne
+    (upsert) em bulk_write não ordenado: linhas com chave já existente
+    substituem o documento, as novas são inseridas. Reenviar o mesmo arquivo
+    não aumenta a coleção. Linhas sem chave são ignoradas e, se a chave se
+    repetir no arquivo, vale a última linha.
+    """
+    try:
+        has_key = df[key_field].notna()
+        skipped = int((~has_key).sum())
+        records = iter_mongo_records(df[has_key].drop_duplicates(subset=key_field, keep='last'))
+        
+        try:
+            ensure_unique_index(collection_name, key_field)
+        except errors.DuplicateKeyError:
+            return False, (
+                f"A coleção já possui valores repetidos em '{key_field}'. "
+                "Remova as duplicatas na aba de limpeza antes de usar o envio por chave."
+            )
+        except errors.OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                raise
+            return False, (
+                f"Já existe um índice em '{key_field}' com opções incompatíveis com o índice único "
+                f"({e}). Ajuste ou remova esse índice antes de usar o envio por chave."
+            )
+        
+        inserted = updated = 0
+        for batch in iter_batches(records, batch_size):
+            requests = [
+                ReplaceOne({key_field: record[key_field]}, record, upsert=True)
+                for record in batch
+            ]
+            # Substituição pela chave é idempotente: pode ser repetida após falhas de rede
+            result = with_retry(lambda db: db[collection_name].bulk_write(requests, ordered=False))
+            inserted += result.upserted_count
+            updated += result.matched_count
+        
+        return True, (inserted, updated, skipped)
     except errors.ServerSelectionTimeoutError:
         return False, "Erro de timeout na conexão com MongoDB. Por favor, tente novamente."
     except Exception as e:
@@ -139,74 +286,119 @@ def upload_to_mongodb(df, collection_name):
 def get_collection_fields(collection_name):
     """Retorna os campos disponíveis em uma collection"""
     try:
-        with mongodb_connection() as db:
-            collection = db[collection_name]
-            sample_doc = collection.find_one()
-            if sample_doc:
-                return list(sample_doc.keys())
-            return []
+        sample_doc = with_retry(lambda db: db[collection_name].find_one())
+        if sample_doc:
+            return list(sample_doc.keys())
+        return []
     except Exception as e:
         st.error(f"Erro ao obter campos: {str(e)}")
         return []
 
-def fast_remove_duplicates(collection_name, field_name):
-    """Remove duplicatas de forma rápida usando pandas"""
+def duplicate_groups_pipeline(field_name):
+    """
+    Pipeline de agregação que devolve um documento por valor repetido do campo.
+
+    Cada grupo traz só o valor, o menor _id (o documento mantido) e a contagem:
+    os _id excedentes não são acumulados no grupo, então um valor com milhões
+    de repetições não esbarra no limite de 16 MB por documento do $group.
+    """
+    return [
+        {'$group': {'_id': f'${field_name}', 'keep': {'$min': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}},
+    ]
+
+def duplicate_filter(field_name, value, keep):
+    """
+    Filtro dos documentos excedentes de um grupo: mesmo valor do campo, exceto o _id mantido.
+
+    A comparação segue o $group: nulo e campo ausente formam o mesmo grupo e
+    um valor simples não casa arrays que apenas o contêm.
+    """
+    if isinstance(value, list):
+        condition = {field_name: value, '$expr': {'$eq': [f'${field_name}', {'$literal': value}]}}
+    else:
+        condition = {field_name: {'$eq': value, '$not': {'$type': 'array'}}}
+    return {**condition, '_id': {'$ne': keep}}
+
+def server_remove_duplicates(collection_name, field_name, batch_size=DEDUP_DELETE_BATCH_SIZE):
+    """
+    Remove duplicatas inteiramente no MongoDB, mantendo o primeiro documento de cada valor.
+
+    Os valores repetidos vêm de uma agregação ($group no campo) e os excedentes
+    de cada valor são apagados com um DeleteMany (valor igual, _id diferente do
+    mantido), enviados em lotes com bulk_write. Apenas um lote de grupos fica
+    na memória e a collection continua legível durante todo o processo (nada é
+    reinserido).
+    """
     try:
+        def delete_groups(requests):
+            # Exclusão pelo valor, poupando o _id mantido, é idempotente: pode ser repetida após falhas de rede
+            return with_retry(lambda db: db[collection_name].bulk_write(requests, ordered=False)).deleted_count
+
         with mongodb_connection() as db:
-            collection = db[collection_name]
-            total_before = collection.count_documents({})
-            
-            # Converte collection para DataFrame em lotes
-            batch_size = 10000
-            df_list = []
-            for batch in collection.find().batch_size(batch_size):
-                df_list.append(pd.DataFrame([batch]))
-            
-            if not df_list:
-                return False, "Collection vazia", 0
-                
-            df = pd.concat(df_list, ignore_index=True)
-            
-            # Remove duplicatas mantendo o primeiro registro
-            df_clean = df.drop_duplicates(subset=field_name, keep='first')
-            removed_count = len(df) - len(df_clean)
-            
-            if removed_count > 0:
-                # Limpa a collection e insere os dados limpos em lotes
-                collection.delete_many({})
-                clean_data = df_clean.to_dict('records')
-                
-                for i in range(0, len(clean_data), batch_size):
-                    batch = clean_data[i:i + batch_size]
-                    collection.insert_many(batch)
-                
-            return True, removed_count, len(df_clean)
+            # Índice usado pelas exclusões de cada grupo (o mesmo da remoção em lotes)
+            db[collection_name].create_index([(field_name, 1), ('_id', 1)])
+            cursor = db[collection_name].aggregate(
+                duplicate_groups_pipeline(field_name), allowDiskUse=True, batchSize=batch_size
+            )
+            removed_count = 0
+            requests = []
+            for group in cursor:
+                requests.append(DeleteMany(duplicate_filter(field_name, group['_id'], group['keep'])))
+                if len(requests) >= batch_size:
+                    removed_count += delete_groups(requests)
+                    requests = []
+            if requests:
+                removed_count += delete_groups(requests)
+
+        remaining_count = with_retry(lambda db: db[collection_name].count_documents({}))
+        return True, removed_count, remaining_count
             
     except Exception as e:
         return False, str(e), 0
 
 def batch_remove_duplicates(collection_name, field_name, batch_size=1000):
-    """Remove duplicatas em lotes para coleções muito grandes"""
+    """
+    Remove duplicatas em lotes para coleções muito grandes.
+
+    A coleção é percorrida pelo índice (campo, _id), de modo que documentos com
+    o mesmo valor chegam em sequência: basta comparar com o valor anterior
+    (memória constante). O primeiro documento de cada valor é mantido e os
+    _id duplicados são apagados em lotes com delete_many/$in.
+    """
     try:
         with mongodb_connection() as db:
             collection = db[collection_name]
-            total_before = collection.count_documents({})
             
-            # Cria índice para o campo de agrupamento
-            collection.create_index(field_name)
+            # Cria índice para o campo de agrupamento (com _id para manter sempre o documento mais antigo)
+            index = [(field_name, 1), ('_id', 1)]
+            collection.create_index(index)
+            
+            def flush(ids):
+                # Exclusão por _id é idempotente: pode ser repetida após falhas de rede
+                return with_retry(lambda db: db[collection_name].delete_many({'_id': {'$in': ids}})).deleted_count
             
             # Processa em lotes
-            unique_values = set()
             duplicates_removed = 0
+            pending_ids = []
+            previous = None
+            first = True
             
-            cursor = collection.find().batch_size(batch_size)
-            for batch in cursor:
-                value = batch.get(field_name)
-                if value in unique_values:
-                    collection.delete_one({'_id': batch['_id']})
-                    duplicates_removed += 1
+            cursor = collection.find({}, {field_name: 1}).sort(index).hint(index).batch_size(batch_size)
+            for doc in cursor:
+                # No BSON booleanos e números são tipos distintos; no Python True == 1 e False == 0
+                value = doc.get(field_name)
+                value = (isinstance(value, bool), value)
+                if not first and value == previous:
+                    pending_ids.append(doc['_id'])
+                    if len(pending_ids) >= batch_size:
+                        duplicates_removed += flush(pending_ids)
+                        pending_ids = []
                 else:
-                    unique_values.add(value)
+                    previous = value
+                    first = False
+            if pending_ids:
+                duplicates_removed += flush(pending_ids)
             
             total_after = collection.count_documents({})
             return True, duplicates_removed, total_after
@@ -275,19 +467,49 @@ def main():
                             })
                             st.dataframe(df_types, use_container_width=True, hide_index=True)
                         
+                        # Modo de envio: inserção simples ou atualização pela chave
+                        upload_mode = st.radio(
+                            "Modo de Envio",
+                            ["Inserir registros", "Atualizar pela chave (sem duplicatas)"],
+                            help="Atualizar pela chave substitui os documentos que já existem com a mesma chave, sem criar duplicatas ao reenviar um arquivo"
+                        )
+                        key_field = None
+                        if upload_mode == "Atualizar pela chave (sem duplicatas)":
+                            columns = list(df.columns)
+                            key_field = st.selectbox(
+                                "Campo chave",
+                                options=columns,
+                                index=columns.index('unique') if 'unique' in columns else 0,
+                                help="Campo com valor único por registro (ex.: a coluna 'unique' gerada nas páginas de XML e PO)"
+                            )
+                        
                         # Botão de upload
                         if collection_name:
                             if st.button("📤 Enviar para MongoDB", type="primary", use_container_width=True):
                                 with st.spinner("Processando upload..."):
-                                    success, result = upload_to_mongodb(df, collection_name)
-                                    if success:
-                                        message_container.success(f"""
-                                            ✅ Upload Concluído com Sucesso!
-                                            • Coleção: {collection_name}
-                                            • Registros Inseridos: {result}
-                                        """)
+                                    if key_field is None:
+                                        success, result = upload_to_mongodb(df, collection_name)
+                                        if success:
+                                            message_container.success(f"""
+                                                ✅ Upload Concluído com Sucesso!
+                                                • Coleção: {collection_name}
+                                                • Registros Inseridos: {result}
+                                            """)
+                                        else:
+                                            message_container.error(result)
                                     else:
-                                        message_container.error(result)
+                                        success, result = upsert_to_mongodb(df, collection_name, key_field)
+                                        if success:
+                                            inserted, updated, skipped = result
+                                            message_container.success(f"""
+                                                ✅ Upload Concluído com Sucesso!
+                                                • Coleção: {collection_name}
+                                                • Registros Inseridos: {inserted}
+                                                • Registros Atualizados: {updated}
+                                                • Linhas sem chave (ignoradas): {skipped}
+                                            """)
+                                        else:
+                                            message_container.error(result)
                         else:
                             st.info("👆 Por favor, insira um nome para a coleção para prosseguir", icon="ℹ️")
                     else:
@@ -319,14 +541,14 @@ def main():
                     # Opção para escolher o método de limpeza
                     cleaning_method = st.radio(
                         "Método de Limpeza",
-                        ["Rápido (Memória)", "Em Lotes (Menor uso de memória)"],
+                        ["Rápido (No servidor)", "Em Lotes (Menor uso de memória)"],
                         help="Escolha o método baseado no tamanho da sua collection"
                     )
                     
                     if st.button("🧹 Remover Duplicatas", type="primary", use_container_width=True):
                         with st.spinner("Removendo duplicatas..."):
-                            if cleaning_method == "Rápido (Memória)":
-                                success, removed_count, remaining_count = fast_remove_duplicates(
+                            if cleaning_method == "Rápido (No servidor)":
+                                success, removed_count, remaining_count = server_remove_duplicates(
                                     clean_collection, selected_field
                                 )
                             else:
@@ -362,6 +584,7 @@ def main():
                 - Digite um nome para sua coleção no MongoDB
                 - Verifique a prévia dos dados exibida
                 - Confirme os tipos de dados das colunas
+                - Escolha o modo de envio: "Atualizar pela chave" permite reenviar o mesmo arquivo sem gerar duplicatas
                 - Clique em "Enviar para MongoDB" para iniciar o upload
                 
                 3. **Verificação**:
@@ -377,7 +600,7 @@ def main():
                 - Digite o nome da coleção que deseja limpar
                 - Selecione o campo que será usado para identificar duplicatas
                 - Escolha o método de limpeza:
-                    * **Rápido**: Ideal para coleções menores (usa mais memória)
+                    * **Rápido**: Executado no próprio MongoDB, sem carregar a coleção na memória
                     * **Em Lotes**: Recomendado para coleções grandes (mais lento, usa menos memória)
                 
                 2. **Processo de Limpeza**:
@@ -0,0 +1,37 @@
+"""
+Paridade do parse_nfe com a extração original (ReadXML.nfe_data).
+
+Cada XML em fixtures/nfe tem ao lado um .json com as linhas esperadas, geradas
+pela implementação original com ElementTree.find: uma linha por item, com as
+colunas na ordem de NFE_COLUMNS. Os casos cobrem blocos emit/dest/cobr
+repetidos (vale a primeira ocorrência), o dVenc lido do primeiro <dup> de
+qualquer <cobr>, blocos ausentes e notas sem itens.
+"""
+import json
+from pathlib import Path
+
+import pytest
+
+from utils.nfe_xml import NFE_COLUMNS, parse_nfe, parse_nfe_bytes
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures' / 'nfe'
+XML_FIXTURES = sorted(FIXTURES_DIR.glob('*.xml'))
+
+
+def load_expected(xml_path):
+    with open(xml_path.with_suffix('.json'), encoding='utf-8') as file:
+        return json.load(file)
+
+
+@pytest.mark.parametrize('xml_path', XML_FIXTURES, ids=lambda path: path.stem)
+def test_parse_nfe_matches_expected_rows(xml_path):
+    expected = load_expected(xml_path)
+    for row in expected:
+        assert list(row) == NFE_COLUMNS
+    assert parse_nfe(str(xml_path)) == [list(row.values()) for row in expected]
+
+
+@pytest.mark.parametrize('xml_path', XML_FIXTURES, ids=lambda path: path.stem)
+def test_parse_nfe_bytes_matches_parse_nfe(xml_path):
+    assert parse_nfe_bytes(xml_path.read_bytes()) == parse_nfe(str(xml_path))
+
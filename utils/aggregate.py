@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+
+def add_group_sums(df, key, sums):
+    """
+    Adiciona ao DataFrame as somas por grupo de várias colunas, repetidas em cada linha do grupo.
+
+    sums mapeia o nome da nova coluna para a coluna somada, por exemplo
+    {'total_itens_po': 'qtd', 'valor_recebido_po': 'vlTotProd'}. A chave é
+    fatorizada uma única vez e todas as somas são calculadas em uma passada,
+    com o mesmo resultado de groupby(key)[coluna].transform('sum') para cada
+    coluna (linhas com chave nula recebem NaN).
+    """
+    codes, uniques = pd.factorize(df[key])
+    valid = codes >= 0
+    source_columns = list(dict.fromkeys(sums.values()))
+    values = df[source_columns]
+    if not valid.all():
+        values = values[valid]
+    totals = values.groupby(codes[valid]).sum()
+
+    for column, source in sums.items():
+        group_totals = totals[source].to_numpy()
+        if valid.all():
+            df[column] = group_totals[codes]
+        else:
+            # O código -1 (chave nula) seleciona o NaN acrescentado ao final
+            if group_totals.dtype.kind in 'iub':
+                group_totals = group_totals.astype(float)
+            df[column] = np.append(group_totals, np.nan)[codes]
+    return df
@@ -0,0 +1,166 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Números aceitos após a troca de separadores (mesmo formato aceito por float())
+_NUMBER_PATTERN = r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$'
+_SEPARATOR_TABLE = bytes.maketrans(b',', b'.')
+
+# Valores com parte inteira acima deste limite são formatados em Python
+_INT_GROUPS = 5
+_MAX_VECTOR_VALUE = 10 ** (3 * _INT_GROUPS)
+_PREFIX = b'R$ '
+_DIGIT_TABLES = [
+    np.frombuffer(''.join(f"{i:03d}"[pos] for i in range(1000)).encode('ascii'), dtype=np.uint8)
+    for pos in range(3)
+]
+# Largura fixa: prefixo + sinal + dígitos com '.' a cada 3 casas + ",dd"
+_WIDTH = len(_PREFIX) + 1 + 4 * _INT_GROUPS - 1 + 3
+_COLUMNS = np.arange(_WIDTH)
+# _VISIBLE[start] marca os bytes exibidos de um valor que começa na coluna start
+_VISIBLE = (_COLUMNS[None, :] < len(_PREFIX)) | (_COLUMNS[None, :] >= np.arange(_WIDTH + 1)[:, None])
+
+
+def format_value(value_str):
+    """Formata o valor substituindo vírgulas por pontos e convertendo para float se possível."""
+    if isinstance(value_str, str):
+        value_str = value_str.replace('.', '').replace(',', '.')
+        try:
+            return float(value_str)
+        except ValueError:
+            return value_str
+    elif isinstance(value_str, (int, float)):
+        return value_str
+    return ""
+
+
+def _swap_separators(text):
+    """Remove os pontos de milhar e troca a vírgula decimal por ponto diretamente no buffer do Arrow."""
+    text = pc.cast(text, pa.large_string())
+    if text.offset:
+        text = pa.concat_arrays([text])
+    validity, offsets, data = text.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int64)[:len(text) + 1]
+    data = np.frombuffer(data, dtype=np.uint8)[offsets[0]:offsets[-1]] if data is not None else np.empty(0, np.uint8)
+    offsets = offsets - offsets[0]
+
+    # Cada offset recua o número de pontos removidos antes dele
+    removed = np.searchsorted(np.flatnonzero(data == ord('.')), offsets)
+    kept = data.tobytes().translate(_SEPARATOR_TABLE, b'.')
+    return pa.LargeStringArray.from_buffers(
+        len(text), pa.py_buffer(offsets - removed), pa.py_buffer(kept), validity
+    )
+
+
+def parse_brl_number(values):
+    """
+    Converte uma coluna no formato brasileiro ("1.234,56") para float.
+
+    Valores numéricos são mantidos; textos vazios, inválidos e nulos viram NaN.
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+
+    try:
+        text = pa.array(values, type=pa.string(), from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Coluna mista (textos e números): converte cada tipo separadamente
+        is_text = values.map(lambda value: isinstance(value, str)).astype(bool)
+        parsed = pd.to_numeric(values.where(~is_text), errors='coerce').astype(float)
+        parsed[is_text] = parse_brl_number(values[is_text].astype(str)).to_numpy()
+        return parsed
+
+    text = _swap_separators(text)
+    null = pa.scalar(None, pa.large_string())
+    text = pc.if_else(pc.equal(pc.binary_length(text), 0), null, text)
+    try:
+        numbers = pc.cast(text, pa.float64())
+    except pa.ArrowInvalid:
+        # Há textos inválidos: apenas os números bem formados são convertidos
+        text = pc.utf8_trim_whitespace(text)
+        text = pc.if_else(pc.match_substring_regex(text, _NUMBER_PATTERN), text, null)
+        numbers = pc.cast(text, pa.float64())
+    return pd.Series(numbers.to_numpy(zero_copy_only=False), index=values.index)
+
+
+def shift_decimal(values, places=2):
+    """
+    Converte valores inteiros em centavos (ex.: "1234.56" lido como 123456) para o valor decimal.
+
+    A parte fracionária da entrada é descartada; nulos e vazios viram NaN.
+    """
+    numbers = pd.to_numeric(pd.Series(values), errors='coerce')
+    return np.trunc(numbers.astype(float)) / 10 ** places
+
+
+def format_brl_currency(values, na_rep=""):
+    """
+    Formata uma coluna numérica como moeda brasileira ("R$ 1.234,56").
+
+    Os valores são arredondados para centavos. Textos no formato brasileiro
+    são convertidos antes da formatação; nulos e inválidos recebem na_rep
+    (ou ficam nulos se na_rep for None). Retorna uma coluna de texto
+    armazenada em Arrow, sem criar um objeto Python por valor.
+    """
+    values = pd.Series(values)
+    numbers = parse_brl_number(values).to_numpy(dtype=float)
+    size = len(numbers)
+
+    valid = np.isfinite(numbers)
+    vector = valid & (np.abs(numbers) < _MAX_VECTOR_VALUE)
+    cents = np.rint(np.where(vector, numbers, 0) * 100).astype(np.int64)
+    negative = cents < 0
+    integer_part, decimal_part = np.divmod(np.abs(cents), 100)
+
+    # Monta os bytes de cada valor alinhados à direita (completados com zeros).
+    # A matriz é preenchida transposta para que cada coluna seja contígua.
+    chars = np.empty((_WIDTH, size), dtype=np.uint8)
+    for col, byte in enumerate(_PREFIX):
+        chars[col] = byte
+    chars[-3] = ord(',')
+    chars[-2] = _DIGIT_TABLES[1][decimal_part]
+    chars[-1] = _DIGIT_TABLES[2][decimal_part]
+
+    digit_columns = []
+    pos = _WIDTH - 4
+    remaining = integer_part
+    for group in range(_INT_GROUPS):
+        remaining, current = np.divmod(remaining, 1000)
+        for offset in range(3):
+            chars[pos - offset] = _DIGIT_TABLES[2 - offset][current]
+            digit_columns.append(pos - offset)
+        pos -= 3
+        if group < _INT_GROUPS - 1:
+            chars[pos] = ord('.')
+            pos -= 1
+
+    # Coluna do primeiro caractere exibido (dígito mais significativo ou sinal)
+    n_digits = np.searchsorted(10 ** np.arange(1, 3 * _INT_GROUPS, dtype=np.int64), integer_part, side='right')
+    start = np.asarray(digit_columns)[n_digits]
+    start[negative] -= 1
+    chars[start[negative], np.flatnonzero(negative)] = ord('-')
+
+    # Copia apenas os bytes exibidos e cria o array de texto do Arrow diretamente dos buffers
+    data = np.ascontiguousarray(chars.T)[_VISIBLE[start]]
+    offsets = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(_WIDTH - start + len(_PREFIX), out=offsets[1:])
+    formatted = pa.LargeStringArray.from_buffers(
+        size,
+        pa.py_buffer(offsets),
+        pa.py_buffer(data),
+        pa.py_buffer(np.packbits(valid, bitorder='little'))
+    )
+
+    large = valid & ~vector
+    if large.any():
+        replacements = [
+            'R$ ' + '{:,.2f}'.format(value).replace(',', 'X').replace('.', ',').replace('X', '.')
+            for value in numbers[large]
+        ]
+        formatted = pc.replace_with_mask(formatted, pa.array(large), pa.array(replacements, pa.large_string()))
+    if na_rep is not None:
+        formatted = pc.fill_null(formatted, na_rep)
+
+    return pd.Series(pd.arrays.ArrowStringArray(formatted), index=values.index)
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Diretório padrão dos caches persistentes (na raiz do projeto)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cache')
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Espera máxima por um lock de escrita antes de desativar o cache (segundos)
+LOCK_TIMEOUT = 5
+
+
+class ContentCache:
+    """
+    Cache persistente em SQLite para resultados de extração, indexado pelo hash do conteúdo.
+
+    Cada cache tem um namespace e uma versão; ao abrir o cache, entradas de
+    versões anteriores do mesmo namespace são descartadas. Quando o tamanho
+    total ultrapassa max_bytes, as entradas acessadas há mais tempo são
+    removidas (LRU). Os valores são serializados em JSON.
+
+    Cada namespace usa seu próprio arquivo e a conexão fica em modo autocommit:
+    cada escrita é uma transação curta, então sessões simultâneas não ficam
+    bloqueadas durante um lote inteiro. Se o banco estiver indisponível,
+    travado ou corrompido, o cache é desativado (available=False) e get/put passam a não
+    fazer nada, sem interromper o processamento.
+    """
+
+    def __init__(self, namespace, version='1', max_bytes=DEFAULT_MAX_BYTES, path=None):
+        self.namespace = namespace
+        self.version = str(version)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self.available = True
+        self.error = None
+        self.conn = None
+
+        if path is None:
+            path = os.path.join(CACHE_DIR, f'{namespace}.sqlite3')
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            self.conn = sqlite3.connect(path, timeout=LOCK_TIMEOUT, isolation_level=None, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_lru ON entries (namespace, last_access)")
+            self.conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND version != ?",
+                (self.namespace, self.version)
+            )
+            self.total_bytes = self.conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries WHERE namespace = ?",
+                (self.namespace,)
+            ).fetchone()[0]
+        except (sqlite3.Error, OSError) as e:
+            self._disable(e)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @staticmethod
+    def key(data):
+        """Retorna o SHA-256 (hex) do conteúdo informado."""
+        return hashlib.sha256(data).hexdigest()
+
+    def _disable(self, error):
+        """Desativa o cache após um erro (banco travado ou corrompido, diretório sem permissão); o processamento segue sem cache."""
+        logger.warning(f"Cache '{self.namespace}' desativado: {error}")
+        self.available = False
+        self.error = str(error)
+
+    def get(self, key):
+        """Retorna o valor armazenado para a chave, ou None se não estiver no cache."""
+        if not self.available:
+            self.misses += 1
+            return None
+        try:
+            row = self.conn.execute(
+                "SELECT value FROM entries WHERE namespace = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._disable(e)
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            self.conn.execute(
+                "UPDATE entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                (time.time(), self.namespace, key)
+            )
+        except sqlite3.Error as e:
+            self._disable(e)
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        """Armazena o valor para a chave e aplica a remoção LRU se o limite de tamanho for excedido."""
+        if not self.available:
+            return
+        payload = json.dumps(value, ensure_ascii=False)
+        size = len(payload.encode('utf-8'))
+        try:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                previous = self.conn.execute(
+                    "SELECT size FROM entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                ).fetchone()
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, version, value, size, last_access) VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.namespace, key, self.version, payload, size, time.time())
+                )
+                self.total_bytes += size - (previous[0] if previous else 0)
+                if self.total_bytes > self.max_bytes:
+                    self._evict()
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def _evict(self):
+        """Remove as entradas menos usadas recentemente até o cache voltar ao limite de tamanho."""
+        while self.total_bytes > self.max_bytes:
+            oldest = self.conn.execute(
+                "SELECT key, size FROM entries WHERE namespace = ? ORDER BY last_access LIMIT 100",
+                (self.namespace,)
+            ).fetchall()
+            if not oldest:
+                self.total_bytes = 0
+                break
+            for key, size in oldest:
+                self.conn.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ?",
+                    (self.namespace, key)
+                )
+                self.total_bytes -= size
+                if self.total_bytes <= self.max_bytes:
+                    break
+
+    def close(self):
+        """Fecha a conexão (as escritas já foram gravadas em transações curtas)."""
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,76 @@
+import io
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+# Motor de leitura: calamine (Rust) é bem mais rápido que o openpyxl nas exportações grandes do SAP
+EXCEL_READ_ENGINE = 'calamine'
+EXCEL_FALLBACK_ENGINE = 'openpyxl'
+
+
+def read_excel_bytes(data, columns=None, engine=EXCEL_READ_ENGINE):
+    """
+    Lê a primeira planilha de um arquivo Excel a partir dos bytes.
+
+    Se columns for informado, apenas essas colunas são carregadas (as que não
+    existirem no arquivo são ignoradas). Se o motor principal falhar (ex.:
+    python-calamine não instalado ou arquivo não suportado), a leitura é
+    repetida com o openpyxl.
+    """
+    usecols = None
+    if columns is not None:
+        wanted = frozenset(columns)
+        usecols = lambda column: column in wanted
+    try:
+        return pd.read_excel(io.BytesIO(data), engine=engine, usecols=usecols)
+    except Exception:
+        if engine == EXCEL_FALLBACK_ENGINE:
+            raise
+        return pd.read_excel(io.BytesIO(data), engine=EXCEL_FALLBACK_ENGINE, usecols=usecols)
+
+
+def read_excel_files(files, columns=None, workers=1, progress=None):
+    """
+    Lê vários arquivos Excel, em processos paralelos quando workers > 1.
+
+    files é uma lista de tuplas (nome do arquivo, bytes). Retorna a lista de
+    DataFrames na mesma ordem do upload e a lista de erros; um arquivo com erro
+    fica como None, sem interromper os demais. progress(concluidos, total, nome)
+    é chamado a cada arquivo finalizado.
+    """
+    total = len(files)
+    frames = [None] * total
+    erros = []
+    done = 0
+
+    def finish(index, frame=None, error=None):
+        nonlocal done
+        file_name = files[index][0]
+        if error is None:
+            frames[index] = frame
+        else:
+            erros.append(f"Erro ao ler o arquivo {file_name}: {error}")
+        done += 1
+        if progress is not None:
+            progress(done, total, file_name)
+
+    if workers <= 1 or total <= 1:
+        for index, (file_name, data) in enumerate(files):
+            try:
+                finish(index, read_excel_bytes(data, columns))
+            except Exception as e:
+                finish(index, error=e)
+        return frames, erros
+
+    columns = list(columns) if columns is not None else None
+    with ProcessPoolExecutor(max_workers=min(workers, total)) as executor:
+        futures = {
+            executor.submit(read_excel_bytes, data, columns): index
+            for index, (file_name, data) in enumerate(files)
+        }
+        for future in as_completed(futures):
+            try:
+                finish(futures[future], future.result())
+            except Exception as e:
+                finish(futures[future], error=e)
+    return frames, erros
@@ -0,0 +1,172 @@
+import hashlib
+import io
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+import streamlit as st
+import xlsxwriter
+
+# Compressão usada nos formatos colunares (Parquet e Arrow IPC)
+COLUMNAR_COMPRESSION = 'zstd'
+
+# Exportação Excel em streaming: linhas convertidas por vez e formato das datas
+EXCEL_CHUNK_SIZE = 5000
+EXCEL_DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+# Limites de uma planilha do Excel (linhas incluem o cabeçalho)
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLS = 16384
+
+
+def _column_to_arrow(column):
+    """Converte uma coluna do pandas para Arrow; colunas de texto são codificadas como dicionário."""
+    try:
+        array = pa.array(column, from_pandas=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Coluna com tipos misturados (ex.: números e textos): exporta como texto
+        array = pa.array(column.astype(str).where(column.notna()), type=pa.string(), from_pandas=True)
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        array = array.dictionary_encode()
+    return array
+
+
+def to_arrow_table(df):
+    """Converte o DataFrame em uma tabela Arrow (sem o índice), com textos codificados como dicionário."""
+    return pa.Table.from_arrays(
+        [_column_to_arrow(df[column]) for column in df.columns],
+        names=[str(column) for column in df.columns]
+    )
+
+
+def to_parquet_bytes(df):
+    """Serializa o DataFrame em Parquet (zstd, textos em dicionário)."""
+    output = io.BytesIO()
+    pq.write_table(to_arrow_table(df), output, compression=COLUMNAR_COMPRESSION)
+    return output.getvalue()
+
+
+def to_arrow_ipc_bytes(df):
+    """Serializa o DataFrame no formato de arquivo Arrow IPC (Feather v2) com compressão zstd."""
+    table = to_arrow_table(df)
+    output = io.BytesIO()
+    options = ipc.IpcWriteOptions(compression=COLUMNAR_COMPRESSION)
+    with ipc.new_file(output, table.schema, options=options) as writer:
+        writer.write_table(table)
+    return output.getvalue()
+
+
+def write_excel_streaming(df, path, sheet_name='Sheet1', chunk_size=EXCEL_CHUNK_SIZE):
+    """
+    Grava o DataFrame em um arquivo Excel linha a linha (xlsxwriter em modo constant_memory).
+
+    Cada linha é enviada ao disco assim que escrita, então a memória usada
+    depende apenas do bloco de chunk_size linhas convertido por vez, e não
+    do tamanho da planilha. Nulos viram células vazias, infinitos são gravados
+    como 'inf'/'-inf' (como no DataFrame.to_excel) e textos são gravados
+    literalmente (sem conversão para fórmulas ou links).
+
+    Se o DataFrame (com o cabeçalho) não couber em uma planilha, levanta
+    ValueError antes de gravar, como o DataFrame.to_excel; o xlsxwriter apenas
+    ignoraria as linhas excedentes.
+    """
+    num_rows, num_cols = len(df) + 1, len(df.columns)
+    if num_rows > EXCEL_MAX_ROWS or num_cols > EXCEL_MAX_COLS:
+        raise ValueError(
+            f"This sheet is too large! Your sheet size is: {num_rows}, {num_cols} "
+            f"Max sheet size is: {EXCEL_MAX_ROWS}, {EXCEL_MAX_COLS}"
+        )
+    workbook = xlsxwriter.Workbook(path, {
+        'constant_memory': True,
+        'strings_to_formulas': False,
+        'strings_to_urls': False,
+        'default_date_format': EXCEL_DATETIME_FORMAT,
+        'remove_timezone': True,
+        'nan_inf_to_errors': True,
+    })
+    try:
+        worksheet = workbook.add_worksheet(sheet_name)
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+        worksheet.write_row(0, 0, [str(column) for column in df.columns], header_format)
+
+        # Colunas de ponto flutuante, onde podem aparecer infinitos
+        float_positions = [
+            position for position, dtype in enumerate(df.dtypes)
+            if pd.api.types.is_float_dtype(dtype)
+        ]
+
+        row = 1
+        for start in range(0, len(df), chunk_size):
+            block = df.iloc[start:start + chunk_size]
+            chunk = block.astype(object)
+            chunk = chunk.where(chunk.notna(), None)
+            for position in float_positions:
+                values = block.iloc[:, position].to_numpy(dtype=float, na_value=np.nan)
+                infinite = np.isinf(values)
+                if infinite.any():
+                    chunk.iloc[infinite, position] = np.where(values[infinite] > 0, 'inf', '-inf')
+            for values in chunk.itertuples(index=False, name=None):
+                worksheet.write_row(row, 0, values)
+                row += 1
+    finally:
+        workbook.close()
+
+
+def to_excel_bytes(df, sheet_name='Sheet1'):
+    """
+    Serializa o DataFrame em Excel usando a gravação em streaming.
+
+    A planilha é montada em um arquivo temporário e apenas o arquivo final
+    (compactado) é lido para a memória, sem base64.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'export.xlsx')
+        write_excel_streaming(df, path, sheet_name=sheet_name)
+        with open(path, 'rb') as file:
+            return file.read()
+
+
+def dataset_version(*parts):
+    """Gera um identificador da versão de um conjunto de dados a partir das partes informadas."""
+    return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+
+def uploaded_files_version(files):
+    """Versão de um conjunto de dados derivado dos arquivos enviados (nome, tamanho e id do upload)."""
+    return dataset_version(*[(file.name, file.size, getattr(file, 'file_id', None)) for file in files])
+
+
+def deferred_download_button(key, version, build, label, file_name, mime, prepare_label="Preparar download"):
+    """
+    Botão de download cujo conteúdo só é gerado quando o usuário solicita.
+
+    build é chamado sem argumentos e deve retornar os bytes do arquivo. O
+    resultado fica em st.session_state associado à versão do conjunto de
+    dados, de modo que reruns com a mesma versão (ex.: mudança de filtros)
+    reutilizam o arquivo sem serializar novamente. Um ValueError de build
+    (ex.: planilha acima do limite do Excel) é exibido como erro na página.
+    """
+    state_key = f'_deferred_export_{key}'
+    cached = st.session_state.get(state_key)
+    if cached is None or cached[0] != version:
+        if not st.button(prepare_label, key=f'{state_key}_prepare'):
+            return False
+        try:
+            with st.spinner("Gerando arquivo..."):
+                cached = (version, build())
+        except ValueError as e:
+            # Ex.: dados maiores que o limite de uma planilha do Excel
+            st.error(f"Não foi possível gerar o arquivo: {e}")
+            return False
+        st.session_state[state_key] = cached
+
+    return st.download_button(
+        label=label,
+        data=cached[1],
+        file_name=file_name,
+        mime=mime,
+        key=f'{state_key}_download'
+    )
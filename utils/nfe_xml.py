@@ -0,0 +1,229 @@
+import gzip
+import hashlib
+import io
+import tarfile
+import zipfile
+import xml.etree.ElementTree as ET
+
+from utils.br_format import format_value
+
+NFE_NS = "http://www.portalfiscal.inf.br/nfe"
+
+# Layout das 48 colunas geradas para cada item (<det>) da nota fiscal
+NFE_COLUMNS = [
+    'chaveNfe', 'NFe', 'Série', 'natOp', 'Data de Emissão', 'info_adic', 'dVenc', 'CNPJ Emitente', 'Nome Emitente',
+    'CNPJ Destinatário', 'Nome Destinatário', 'Valor NF-e', 'Valor Frete', 'Item Nota', 'Cód Produto',
+    'Quantidade', 'Descrição', 'Unidade Medida', 'vlUnProd', 'vlTotProd', 'ncm', 'cfop', 'xPed', 'nItemPed',
+    'infAdProd', 'Data Importação', 'Usuário', 'Data Saída', 'Fatura', 'Duplicata', 'Valor Original', 'Valor Pago',
+    'Logradouro Emitente', 'Número Emitente', 'Complemento Emitente', 'Bairro Emitente', 'Município Emitente',
+    'UF Emitente', 'CEP Emitente', 'País Emitente', 'Logradouro Destinatário', 'Número Destinatário',
+    'Complemento Destinatário', 'Bairro Destinatário', 'Município Destinatário', 'UF Destinatário',
+    'CEP Destinatário', 'País Destinatário'
+]
+
+# Caminhos (relativos à raiz do documento) dos campos lidos uma única vez por nota
+HEADER_PATHS = {
+    ('NFe', 'infNFe', 'ide', 'nNF'): 'NFe',
+    ('NFe', 'infNFe', 'ide', 'serie'): 'Série',
+    ('NFe', 'infNFe', 'ide', 'natOp'): 'natOp',
+    ('NFe', 'infNFe', 'ide', 'dhEmi'): 'Data de Emissão',
+    ('NFe', 'infNFe', 'infAdic', 'infCpl'): 'info_adic',
+    ('NFe', 'infNFe', 'cobr', 'dup', 'dVenc'): 'dVenc',
+    ('NFe', 'infNFe', 'emit', 'CNPJ'): 'CNPJ Emitente',
+    ('NFe', 'infNFe', 'emit', 'xNome'): 'Nome Emitente',
+    ('NFe', 'infNFe', 'dest', 'CNPJ'): 'CNPJ Destinatário',
+    ('NFe', 'infNFe', 'dest', 'xNome'): 'Nome Destinatário',
+    ('NFe', 'infNFe', 'total', 'ICMSTot', 'vNF'): 'Valor NF-e',
+    ('NFe', 'infNFe', 'total', 'ICMSTot', 'vFrete'): 'Valor Frete',
+    ('NFe', 'infNFe', 'transp', 'vol', 'veicId'): 'Data Importação',
+    ('NFe', 'infNFe', 'transp', 'vol', 'placa'): 'Usuário',
+    ('NFe', 'infNFe', 'transp', 'vol', 'uf'): 'Data Saída',
+    ('NFe', 'infNFe', 'cobr', 'fat', 'nFat'): 'Fatura',
+    ('NFe', 'infNFe', 'cobr', 'dup', 'nDup'): 'Duplicata',
+    ('NFe', 'infNFe', 'cobr', 'fat', 'vOrig'): 'Valor Original',
+    ('NFe', 'infNFe', 'cobr', 'fat', 'vLiq'): 'Valor Pago',
+    ('NFe', 'infNFe', 'emit', 'enderEmit', 'xLgr'): 'Logradouro Emitente',
+    ('NFe', 'infNFe', 'emit', 'enderEmit', 'nro'): 'Número Emitente',
+    ('NFe', 'infNFe', 'emit', 'enderEmit', 'complemento'): 'Complemento Emitente',
+    ('NFe', 'infNFe', 'emit', 'enderEmit', 'xBairro'): 'Bairro Emitente',
+    ('NFe', 'infNFe', 'emit', 'enderEmit', 'xMun'): 'Município Emitente',
+    ('NFe', 'infNFe', 'emit', 'enderEmit', 'UF'): 'UF Emitente',
+    ('NFe', 'infNFe', 'emit', 'enderEmit', 'CEP'): 'CEP Emitente',
+    ('NFe', 'infNFe', 'emit', 'enderEmit', 'cPais'): 'País Emitente',
+    ('NFe', 'infNFe', 'dest', 'enderDest', 'xLgr'): 'Logradouro Destinatário',
+    ('NFe', 'infNFe', 'dest', 'enderDest', 'nro'): 'Número Destinatário',
+    ('NFe', 'infNFe', 'dest', 'enderDest', 'complemento'): 'Complemento Destinatário',
+    ('NFe', 'infNFe', 'dest', 'enderDest', 'xBairro'): 'Bairro Destinatário',
+    ('NFe', 'infNFe', 'dest', 'enderDest', 'xMun'): 'Município Destinatário',
+    ('NFe', 'infNFe', 'dest', 'enderDest', 'UF'): 'UF Destinatário',
+    ('NFe', 'infNFe', 'dest', 'enderDest', 'CEP'): 'CEP Destinatário',
+    ('NFe', 'infNFe', 'dest', 'enderDest', 'cPais'): 'País Destinatário',
+}
+
+# Blocos cujos campos são lidos apenas da primeira ocorrência do bloco
+SCOPED_PATHS = {
+    ('NFe', 'infNFe', 'emit'),
+    ('NFe', 'infNFe', 'dest'),
+    ('NFe', 'infNFe', 'cobr'),
+}
+SCOPED_FIELDS = {
+    key for path, key in HEADER_PATHS.items()
+    if path[:3] in SCOPED_PATHS and key != 'dVenc'
+}
+
+# Caminhos (relativos a cada <det>) dos campos do item
+DET_PATH = ('NFe', 'infNFe', 'det')
+ITEM_PATHS = {
+    ('prod', 'cProd'): 'Cód Produto',
+    ('prod', 'qCom'): 'Quantidade',
+    ('prod', 'xProd'): 'Descrição',
+    ('prod', 'uCom'): 'Unidade Medida',
+    ('prod', 'vUnCom'): 'vlUnProd',
+    ('prod', 'vProd'): 'vlTotProd',
+    ('prod', 'NCM'): 'ncm',
+    ('prod', 'CFOP'): 'cfop',
+    ('prod', 'xPed'): 'xPed',
+    ('prod', 'nItemPed'): 'nItemPed',
+    ('infAdProd',): 'infAdProd',
+}
+
+# Extensões de arquivos compactados aceitos no upload
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz')
+# XML avulso compactado com gzip (ex.: nota.xml.gz)
+GZIP_EXTENSIONS = ('.gz',)
+
+# Campos numéricos convertidos com format_value
+VALUE_FIELDS = ('Valor NF-e', 'Valor Frete', 'Valor Original', 'Valor Pago')
+
+# Versão do layout das linhas geradas, para caches de notas já processadas. Muda
+# automaticamente quando as tabelas de colunas/caminhos mudam; incremente
+# NFE_EXTRACTOR_VERSION ao alterar a lógica de extração.
+NFE_EXTRACTOR_VERSION = '1'
+NFE_LAYOUT_VERSION = NFE_EXTRACTOR_VERSION + '-' + hashlib.sha256(
+    repr((NFE_COLUMNS, HEADER_PATHS, sorted(SCOPED_PATHS), ITEM_PATHS, VALUE_FIELDS)).encode('utf-8')
+).hexdigest()[:16]
+
+_NS_PREFIX = '{' + NFE_NS + '}'
+_NS_PREFIX_LEN = len(_NS_PREFIX)
+_ITEM_START = len(DET_PATH)
+
+
+def _local_name(tag):
+    """Retorna o nome local de uma tag do namespace NF-e, ou None para outros namespaces."""
+    if tag.startswith(_NS_PREFIX):
+        return tag[_NS_PREFIX_LEN:]
+    return None
+
+
+def parse_nfe(xml_file):
+    """
+    Extrai os itens de uma NF-e em uma única passada com iterparse.
+
+    Os campos de cabeçalho são lidos uma vez por documento e os elementos são
+    descartados à medida que são processados. Retorna uma lista de linhas no
+    layout de NFE_COLUMNS (uma por item <det>).
+    """
+    chNFe = None
+    header = {}
+    items = []
+    item = None
+    path = []
+    seen_scopes = set()
+    repeated_scope = None
+
+    for event, elem in ET.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            path.append(_local_name(elem.tag))
+            # O primeiro <infNFe> abaixo da raiz fornece a chave de acesso
+            if chNFe is None and len(path) > 1 and path[-1] == 'infNFe':
+                chNFe = elem.attrib.get('Id', '')
+            if len(path) == 4:
+                rel = tuple(path[1:])
+                if rel == DET_PATH and item is None:
+                    item = {}
+                elif rel in SCOPED_PATHS:
+                    if rel in seen_scopes:
+                        repeated_scope = rel
+                    seen_scopes.add(rel)
+            continue
+
+        rel = tuple(path[1:])
+        if item is not None and len(rel) > _ITEM_START:
+            key = ITEM_PATHS.get(rel[_ITEM_START:])
+            if key is not None and key not in item:
+                item[key] = elem.text or ""
+        else:
+            key = HEADER_PATHS.get(rel)
+            if key is not None and key not in header:
+                if repeated_scope is None or key not in SCOPED_FIELDS:
+                    header[key] = elem.text or ""
+            elif item is not None and rel == DET_PATH:
+                items.append(item)
+                item = None
+            elif rel == repeated_scope:
+                repeated_scope = None
+
+        path.pop()
+        elem.clear()
+
+    for key in VALUE_FIELDS:
+        header[key] = format_value(header.get(key, ""))
+    header['chaveNfe'] = chNFe or ""
+
+    notas = []
+    for itemNota, item in enumerate(items, start=1):
+        row = dict(header)
+        row.update(item)
+        row['Item Nota'] = itemNota
+        notas.append([row.get(column, "") for column in NFE_COLUMNS])
+    return notas
+
+
+def parse_nfe_bytes(data):
+    """Extrai os itens de uma NF-e a partir do conteúdo bruto do arquivo (usado pelos processos de trabalho)."""
+    return parse_nfe(io.BytesIO(data))
+
+
+def _is_xml_member(member_name):
+    """Indica se o membro de um arquivo compactado é um XML de nota (ignora __MACOSX/ e arquivos ocultos)."""
+    parts = member_name.replace('\\', '/').split('/')
+    base_name = parts[-1]
+    return (
+        '__MACOSX' not in parts
+        and not base_name.startswith('.')
+        and base_name.lower().endswith('.xml')
+    )
+
+
+def iter_xml_files(files):
+    """
+    Gera um arquivo (file-like) para cada XML enviado.
+
+    Arquivos .zip e .tar/.tar.gz são lidos membro a membro diretamente do
+    arquivo compactado, sem extração em disco; apenas o membro atual é
+    descompactado por vez. Um .gz que não seja .tar.gz é tratado como um XML
+    avulso compactado. Metadados do macOS (__MACOSX/, ._arquivo.xml) e
+    arquivos ocultos dentro dos compactados são ignorados.
+    """
+    for uploaded_file in files:
+        name = uploaded_file.name.lower()
+        uploaded_file.seek(0)
+        if name.endswith(ZIP_EXTENSIONS):
+            with zipfile.ZipFile(uploaded_file) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and _is_xml_member(info.filename):
+                        with archive.open(info) as member:
+                            yield member
+        elif name.endswith(TAR_EXTENSIONS):
+            with tarfile.open(fileobj=uploaded_file, mode='r|*') as archive:
+                for info in archive:
+                    if info.isfile() and _is_xml_member(info.name):
+                        member = archive.extractfile(info)
+                        if member is not None:
+                            yield member
+        elif name.endswith(GZIP_EXTENSIONS):
+            with gzip.GzipFile(fileobj=uploaded_file, mode='rb') as member:
+                yield member
+        else:
+            yield uploaded_file
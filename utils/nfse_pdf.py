@@ -0,0 +1,380 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+from collections import deque
+from contextlib import closing, contextmanager
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pdfplumber
+import pypdfium2 as pdfium
+
+# Campos extraídos de cada NFS-e (além do nome do arquivo)
+NFSE_FIELDS = [
+    "Numero NFS-e",
+    "Data Emissão",
+    "Competencia",
+    "Codigo de Verificacao",
+    "Numero RPS",
+    "NF-e Substituida",
+    "Razao Social Prestador",
+    "CNPJ Prestador",
+    "Telefone Prestador",
+    "Email Prestador",
+    "Razao Social Tomador",
+    "CNPJ Tomador",
+    "Endereco Tomador",
+    "Telefone Tomador",
+    "Email Tomador",
+    "Discriminacao do Servico",
+    "Codigo Servico",
+    "Detalhamento Especifico",
+    "Codigo da Obra",
+    "Codigo ART",
+    "Tributos Federais",
+    "Valor do Servico",
+    "Desconto Incondicionado",
+    "Desconto Condicionado",
+    "Retencao Federal",
+    "ISSQN Retido",
+    "Valor Liquido",
+    "Regime Especial Tributacao",
+    "Simples Nacional",
+    "Incentivador Cultural",
+    "Avisos",
+]
+
+# Tabela declarativa dos campos da NFS-e:
+# (campos preenchidos, padrão, grupo com o valor, limpa os campos quando o padrão não é encontrado na página).
+# Os padrões são aplicados em ordem a cada página; um padrão que preenche vários campos é buscado uma única vez.
+NFSE_FIELD_SPECS = [
+    (("Numero NFS-e",), r"NFS-e\s*:?\s*([\d]+)", 1, False),
+    (("Data Emissão",), r"Data e Hora da Emissão\s*:?\s*([\d]{1,2}/[\d]{1,2}/[\d]{4}\s+\d{1,2}:\d{2})", 1, False),
+    (("Competencia",), r"Competência\s*:?\s*(.+)", 1, False),
+    (("Codigo de Verificacao",), r"Código de Verificação\s*:?\s*(.+)", 1, False),
+    (("Numero RPS",), r"Número do RPS\s*:?\s*([\d]+)", 1, False),
+    # Sem o padrão específico do Tomador (mais abaixo), a Razão Social do Tomador fica com este valor
+    (("NF-e Substituida", "Razao Social Tomador"), r"No. da NFS-e substituída\s*:?\s*([\d]+)", 1, False),
+    (("Razao Social Prestador",), r"Razão Social/Nome\s*:?\s*(.+)", 1, False),
+    # A primeira ocorrência na página preenche tanto o Prestador quanto o Tomador
+    (("CNPJ Prestador", "CNPJ Tomador"), r"CNPJ/CPF\s*:?\s*([\d\.\-/]+)", 1, False),
+    (("Telefone Prestador", "Telefone Tomador"), r"Telefone\s*:?\s*([\d\(\)\s\-]+)", 1, False),
+    (("Email Prestador", "Email Tomador"), r"e-mail\s*:?\s*([\w\.\-]+@[\w\.\-]+)", 1, False),
+    (("Razao Social Tomador",), r"Tomador de Serviço\s*Razão Social/Nome\s*:?\s*(.+)", 1, False),
+    (("Endereco Tomador",), r"Endereço e CEP\s*:?\s*(.+)", 1, False),
+    (
+        ("Discriminacao do Servico",),
+        r"(?s)Discriminação (do|dos) Serviço(s)?\s*(.+?)(?=Código do Serviço|Detalhamento Específico|Tributos Federais|Valor do Serviço)",
+        3,
+        False
+    ),
+    (("Codigo Servico",), r"Código do Serviço\s*/\s*Atividade\s*(.+)", 1, False),
+    (("Detalhamento Especifico",), r"Detalhamento Específico da Construção Civil\s*(.+)", 1, False),
+    (("Codigo da Obra",), r"Código da Obra\s*(.+)", 1, False),
+    (("Codigo ART",), r"Código ART\s*(.+)", 1, False),
+    (("Tributos Federais",), r"Tributos Federais\s*(.+)", 1, False),
+    (("Valor do Servico",), r"Valor (do|dos) Serviço(s)?\s*R\$\s*([\d,\.]+)", 3, True),
+    (("Desconto Incondicionado",), r"Desconto Incondicionado\s*R\$\s*([\d,\.]+)", 1, True),
+    (("Desconto Condicionado",), r"Desconto Condicionado\s*R\$\s*([\d,\.]+)", 1, True),
+    (("Retencao Federal",), r"Retenções Federais\s*R\$\s*([\d,\.]+)", 1, True),
+    (("ISSQN Retido",), r"ISSQN Retido\s*R\$\s*([\d,\.]+)", 1, True),
+    (("Valor Liquido",), r"Valor Líquido\s*R\$\s*([\d,\.]+)", 1, True),
+    (("Regime Especial Tributacao",), r"Regime Especial Tributação\s*(.+)", 1, False),
+    (("Simples Nacional",), r"Opção Simples Nacional\s*(.+)", 1, False),
+    (("Incentivador Cultural",), r"Incentivador Cultural\s*(.+)", 1, False),
+    (("Avisos",), r"Avisos\s*(.+)", 1, False),
+]
+
+_COMPILED_FIELD_SPECS = [
+    (fields, re.compile(pattern), group, reset)
+    for fields, pattern, group, reset in NFSE_FIELD_SPECS
+]
+
+# Campos que encerram a leitura do PDF no modo early_exit quando todos já foram encontrados
+NFSE_REQUIRED_FIELDS = (
+    "Numero NFS-e",
+    "Data Emissão",
+    "Codigo de Verificacao",
+    "Razao Social Prestador",
+    "CNPJ Prestador",
+    "Valor do Servico",
+    "Valor Liquido",
+)
+
+# Leitor de texto padrão: 'pdfplumber', 'pdfium' ou 'auto' (PDFium com o pdfplumber como reserva)
+DEFAULT_TEXT_BACKEND = 'auto'
+
+# Cache persistente das extrações. A versão muda automaticamente quando a tabela de
+# campos muda; incremente NFSE_EXTRACTOR_VERSION ao alterar a lógica de extração.
+NFSE_EXTRACTOR_VERSION = '1'
+NFSE_CACHE_NAMESPACE = 'nfse_pdf'
+NFSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+NFSE_CACHE_VERSION = NFSE_EXTRACTOR_VERSION + '-' + hashlib.sha256(
+    repr((NFSE_FIELDS, NFSE_REQUIRED_FIELDS, NFSE_FIELD_SPECS)).encode('utf-8')
+).hexdigest()[:16]
+
+# PDFs acima deste tamanho são abertos a partir de um arquivo temporário
+PDF_TEMPFILE_THRESHOLD = 50 * 1024 * 1024
+
+# Máximo de PDFs enviados a cada processo de trabalho antes de aguardar resultados
+PDF_TASKS_PER_WORKER = 4
+
+
+def extract_fields(text, dados_nf):
+    """Preenche dados_nf com os campos encontrados no texto de uma página (uma busca por padrão compilado)."""
+    for fields, pattern, group, reset in _COMPILED_FIELD_SPECS:
+        match = pattern.search(text)
+        if match:
+            value = match.group(group).strip()
+        elif reset:
+            value = None
+        else:
+            continue
+        for field in fields:
+            dados_nf[field] = value
+
+
+@contextmanager
+def open_pdf(pdf_bytes, tempfile_threshold=PDF_TEMPFILE_THRESHOLD):
+    """
+    Abre o PDF com o pdfplumber diretamente do conteúdo em memória.
+
+    Somente PDFs maiores que tempfile_threshold são gravados em um arquivo
+    temporário antes de abrir, para que o pdfminer leia o arquivo do disco
+    sob demanda em vez de manter um segundo buffer do documento.
+    """
+    if len(pdf_bytes) <= tempfile_threshold:
+        with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+            yield pdf
+        return
+
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        tmp_file.write(pdf_bytes)
+        tmp_file_path = tmp_file.name
+    try:
+        with pdfplumber.open(tmp_file_path) as pdf:
+            yield pdf
+    finally:
+        os.unlink(tmp_file_path)
+
+
+def _pdfplumber_page_texts(pdf_bytes, max_pages=None, crop_bbox=None):
+    """Gera o texto de cada página com o pdfplumber (análise de layout caractere a caractere)."""
+    with open_pdf(pdf_bytes) as pdf:
+        pages = pdf.pages if max_pages is None else pdf.pages[:max_pages]
+        for page in pages:
+            if crop_bbox is not None:
+                x0, top, x1, bottom = crop_bbox
+                page = page.within_bbox((x0 * page.width, top * page.height, x1 * page.width, bottom * page.height))
+            yield page.extract_text()
+
+
+def _pdfium_page_texts(pdf_bytes, max_pages=None, crop_bbox=None):
+    """Gera o texto de cada página com a extração nativa do PDFium (pypdfium2)."""
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        total = len(pdf) if max_pages is None else min(len(pdf), max_pages)
+        for index in range(total):
+            page = pdf[index]
+            textpage = page.get_textpage()
+            try:
+                if crop_bbox is None:
+                    text = textpage.get_text_bounded()
+                else:
+                    # O PDFium usa origem no canto inferior esquerdo da página
+                    x0, top, x1, bottom = crop_bbox
+                    width, height = page.get_size()
+                    text = textpage.get_text_bounded(
+                        left=x0 * width, bottom=(1 - bottom) * height, right=x1 * width, top=(1 - top) * height
+                    )
+            finally:
+                textpage.close()
+                page.close()
+            yield text.replace('\r\n', '\n')
+    finally:
+        pdf.close()
+
+
+# Leitores de texto disponíveis para extrair_dados_nf
+TEXT_BACKENDS = {
+    'pdfplumber': _pdfplumber_page_texts,
+    'pdfium': _pdfium_page_texts,
+}
+
+
+def _has_required_fields(dados_nf):
+    """Indica se todos os NFSE_REQUIRED_FIELDS foram preenchidos."""
+    return all(dados_nf[field] is not None for field in NFSE_REQUIRED_FIELDS)
+
+
+def extrair_dados_nf(pdf_bytes, file_name, avisos=None, max_pages=None, early_exit=False, crop_bbox=None,
+                     backend=DEFAULT_TEXT_BACKEND):
+    """
+    Extrai dados importantes da Nota Fiscal do PDF.
+
+    Recebe o conteúdo do PDF em bytes (para poder rodar em outro processo).
+    Páginas sem texto são registradas em avisos, se informado.
+
+    Por padrão todas as páginas são lidas e páginas posteriores sobrescrevem
+    os campos. Opções para documentos com anexos:
+    - max_pages: lê apenas as primeiras N páginas;
+    - early_exit: para assim que todos os NFSE_REQUIRED_FIELDS estiverem preenchidos;
+    - crop_bbox: extrai só a região (x0, top, x1, bottom), em frações da página.
+    O número de páginas lidas fica em "Paginas Processadas".
+
+    backend escolhe o leitor de texto: 'pdfplumber', 'pdfium' ou 'auto'
+    (PDFium, refazendo com o pdfplumber quando o PDFium não abrir o arquivo,
+    faltar algum campo obrigatório ou alguma página vier sem texto).
+    """
+    if backend == 'auto':
+        fast_avisos = []
+        try:
+            dados_nf = extrair_dados_nf(pdf_bytes, file_name, fast_avisos, max_pages, early_exit, crop_bbox, 'pdfium')
+            if _has_required_fields(dados_nf) and not fast_avisos:
+                return dados_nf
+        except pdfium.PdfiumError:
+            pass
+        backend = 'pdfplumber'
+
+    dados_nf = empty_record(file_name)
+    with closing(TEXT_BACKENDS[backend](pdf_bytes, max_pages, crop_bbox)) as page_texts:
+        for text in page_texts:
+            dados_nf["Paginas Processadas"] += 1
+
+            if not text:
+                if avisos is not None:
+                    avisos.append(f"Falha ao extrair texto do PDF: {file_name}")
+                continue
+
+            extract_fields(text, dados_nf)
+            if early_exit and _has_required_fields(dados_nf):
+                break
+
+    return dados_nf
+
+
+def empty_record(file_name):
+    """Registro vazio (todos os campos nulos) usado para PDFs que não puderam ser lidos."""
+    return {
+        **{field: None for field in NFSE_FIELDS},
+        "Nome do Arquivo": file_name,
+        "Paginas Processadas": 0,
+        "Lido do Cache": False,
+    }
+
+
+def _extract_task(pdf_bytes, file_name, options):
+    """Executa a extração de um PDF em um processo de trabalho, devolvendo os dados e os avisos."""
+    avisos = []
+    return extrair_dados_nf(pdf_bytes, file_name, avisos, **options), avisos
+
+
+def nfse_cache_key(pdf_bytes, options):
+    """Chave do cache: SHA-256 do PDF combinado com as opções de extração que alteram o resultado."""
+    digest = hashlib.sha256(pdf_bytes)
+    digest.update(repr(sorted(options.items())).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def extract_nfse_batch(files, workers=1, progress=None, cache=None, **options):
+    """
+    Extrai os dados de vários PDFs de NFS-e, em paralelo quando workers > 1.
+
+    files é uma lista de tuplas (nome do arquivo, bytes do PDF). Retorna a
+    lista de registros na mesma ordem do upload e a lista de avisos. Um PDF
+    com erro gera um registro vazio e um aviso, sem interromper o lote.
+    progress(concluidos, total) é chamado a cada PDF finalizado. As demais
+    opções (max_pages, early_exit, crop_bbox, backend) são repassadas a extrair_dados_nf.
+
+    Com um ContentCache (namespace NFSE_CACHE_NAMESPACE, versão NFSE_CACHE_VERSION),
+    PDFs já extraídos com as mesmas opções são lidos do cache e marcados com
+    "Lido do Cache" = True. Somente extrações sem erros nem avisos são gravadas.
+    """
+    total = len(files)
+    records = [None] * total
+    avisos = []
+    done = 0
+    keys = [None] * total
+
+    def finish(index, result=None, error=None):
+        nonlocal done
+        file_name = files[index][0]
+        if error is None:
+            records[index], file_avisos = result
+            avisos.extend(file_avisos)
+            if cache is not None and not file_avisos:
+                cache.put(keys[index], records[index])
+        else:
+            records[index] = empty_record(file_name)
+            avisos.append(f"Erro ao processar o PDF {file_name}: {error}")
+        done += 1
+        if progress is not None:
+            progress(done, total)
+
+    pending = deque()
+    for index, (file_name, pdf_bytes) in enumerate(files):
+        if cache is not None:
+            keys[index] = nfse_cache_key(pdf_bytes, options)
+            cached = cache.get(keys[index])
+            if cached is not None:
+                # "Paginas Processadas" é da extração original: o registro é marcado como lido do cache
+                records[index] = {**cached, "Nome do Arquivo": file_name, "Lido do Cache": True}
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+                continue
+        pending.append(index)
+
+    if workers <= 1:
+        for index in pending:
+            file_name, pdf_bytes = files[index]
+            try:
+                finish(index, _extract_task(pdf_bytes, file_name, options))
+            except Exception as e:
+                finish(index, error=e)
+        return records, avisos
+
+    suspects = []
+    max_in_flight = workers * PDF_TASKS_PER_WORKER
+    executor = ProcessPoolExecutor(max_workers=workers)
+    in_flight = {}
+    try:
+        while pending or in_flight:
+            # Mantém uma janela limitada de PDFs em processamento (memória proporcional à janela)
+            while pending and len(in_flight) < max_in_flight:
+                index = pending.popleft()
+                file_name, pdf_bytes = files[index]
+                in_flight[executor.submit(_extract_task, pdf_bytes, file_name, options)] = index
+
+            completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            pool_broken = False
+            for future in completed:
+                index = in_flight.pop(future)
+                try:
+                    finish(index, future.result())
+                except BrokenProcessPool:
+                    pool_broken = True
+                    suspects.append(index)
+                except Exception as e:
+                    finish(index, error=e)
+            if pool_broken:
+                # Um PDF derrubou um processo de trabalho: os PDFs afetados são
+                # reprocessados isoladamente no final e o lote segue em um novo pool
+                suspects.extend(in_flight.values())
+                in_flight.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    for index in sorted(suspects):
+        file_name, pdf_bytes = files[index]
+        with ProcessPoolExecutor(max_workers=1) as isolated:
+            try:
+                finish(index, isolated.submit(_extract_task, pdf_bytes, file_name, options).result())
+            except Exception as e:
+                finish(index, error=e)
+
+    return records, avisos
@@ -0,0 +1,73 @@
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+
+def slugify(text):
+    """
+    Convert a text string into a slug format.
+    - Convert to lowercase
+    - Remove special characters
+    - Replace spaces with hyphens
+    - Remove consecutive hyphens
+    """
+    if not isinstance(text, str):
+        text = str(text)
+    
+    # Convert to lowercase and normalize unicode characters
+    text = text.lower()
+    text = unicodedata.normalize('NFKD', text)
+    text = text.encode('ascii', 'ignore').decode('utf-8')
+    
+    # Replace any non-alphanumeric character with a hyphen
+    text = re.sub(r'[^a-z0-9]+', '-', text)
+    
+    # Remove leading and trailing hyphens
+    text = text.strip('-')
+    
+    # Replace multiple consecutive hyphens with a single hyphen
+    text = re.sub(r'-+', '-', text)
+    
+    return text
+
+
+def slugify_series(series):
+    """
+    Aplica slugify a uma coluna inteira.
+
+    O slug é calculado uma única vez para cada valor distinto da coluna e
+    depois distribuído para as linhas, evitando repetir a normalização
+    unicode e as expressões regulares em valores duplicados.
+    """
+    codes, uniques = pd.factorize(series.astype(str))
+    slugs = np.array([slugify(value) for value in uniques], dtype=object)
+    return pd.Series(slugs[codes], index=series.index)
+
+
+def build_unique_key(columns, mode='slug'):
+    """
+    Gera a chave única de cada linha a partir de várias colunas.
+
+    mode='slug' produz o mesmo resultado de slugify aplicado às colunas
+    concatenadas com '-'. mode='hash' gera um hash hexadecimal de 64 bits
+    dos valores originais (sem normalização), bem mais rápido para grandes
+    volumes.
+    """
+    if mode == 'hash':
+        frame = pd.concat([column.astype(str) for column in columns], axis=1, ignore_index=True)
+        hashes = pd.util.hash_pandas_object(frame, index=False)
+        return hashes.map('{:016x}'.format)
+
+    # O separador '-' sempre vira fronteira do slug, então cada coluna pode ser
+    # convertida separadamente e as partes não vazias unidas com '-'
+    key = None
+    for column in columns:
+        part = slugify_series(column)
+        if key is None:
+            key = part
+        else:
+            separator = np.where((key != '') & (part != ''), '-', '')
+            key = key + separator + part
+    return key